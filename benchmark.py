@@ -0,0 +1,113 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import shutil
+import tempfile
+import time
+
+from playwright.async_api import async_playwright
+
+import bot
+from fixture_server import start_fixture_server
+
+# Runs the full booking flow N times against the offline fixtures and
+# reports p50/p95 per phase, so performance changes can be measured
+# without network access.
+#
+#   python benchmark.py --runs 10 --latency-ms 100
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a list of numbers.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+def print_report(results):
+    phases = []
+    for result in results:
+        for name in result["phases"]:
+            if name not in phases:
+                phases.append(name)
+
+    print()
+    print(f"{'phase':<12} {'p50 ms':>10} {'p95 ms':>10} {'runs':>6}")
+    for name in phases + ["total"]:
+        if name == "total":
+            values = [r["total_ms"] for r in results]
+        else:
+            values = [r["phases"][name] for r in results if name in r["phases"]]
+        print(f"{name:<12} {percentile(values, 50):>10.0f} {percentile(values, 95):>10.0f} {len(values):>6}")
+
+    outcomes = {}
+    for result in results:
+        outcomes[result["outcome"]] = outcomes.get(result["outcome"], 0) + 1
+    print(f"Outcomes: {outcomes}")
+
+async def run_benchmark(runs, cold, latency_ms, jitter_ms, free_slots, data_dir=None):
+    server, url = start_fixture_server(latency_ms=latency_ms, jitter_ms=jitter_ms, free_slots=free_slots)
+    print(f"Fixture server at {url} (latency {latency_ms} ms, jitter {jitter_ms} ms)")
+
+    # Point the bot at the fixtures and fill in placeholder details if .env has none
+    bot.TARGET_URL = url
+    for name, value in (("FIRST_NAME", "Bench"), ("LAST_NAME", "Runner"), ("EMAIL", "bench@example.com"),
+                        ("PHONE", "0800000000"), ("STUDENT_ID", "6500000000")):
+        if not getattr(bot, name):
+            setattr(bot, name, value)
+
+    # Keep caches, run records and artifacts of fixture runs out of the real .cache/ and results/
+    temporary = data_dir is None
+    data_dir = data_dir or tempfile.mkdtemp(prefix="booking-benchmark-")
+    bot.set_data_dirs(os.path.join(data_dir, "cache"), os.path.join(data_dir, "results"))
+    print(f"Caches and results for this run go to {data_dir}")
+
+    results = []
+    try:
+        async with async_playwright() as p:
+            browser = None
+            for i in range(runs):
+                server.state.reset()
+                # Launch and context creation count towards the run total, not a phase
+                started = time.perf_counter()
+                if browser is None:
+                    browser = await bot.launch_browser(p)
+                context = await bot.new_booking_context(browser)
+                timer = bot.PhaseTimer()
+                outcome = await bot.run_booking(context, timer)
+                await context.close()
+                if cold:
+                    await browser.close()
+                    browser = None
+                total_ms = (time.perf_counter() - started) * 1000
+                results.append({"run": i + 1, "outcome": outcome, "total_ms": total_ms, "phases": timer.durations})
+                print(f"Run {i + 1}/{runs}: {outcome} in {total_ms:.0f} ms")
+            if browser is not None:
+                await browser.close()
+    finally:
+        server.shutdown()
+        if temporary:
+            shutil.rmtree(data_dir, ignore_errors=True)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the booking flow against local fixtures.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--cold", action="store_true", help="launch a new browser for every run")
+    parser.add_argument("--latency-ms", type=int, default=0)
+    parser.add_argument("--jitter-ms", type=int, default=0)
+    parser.add_argument("--free-slots", type=int, default=3, help="0 benchmarks the 'no slots' path")
+    parser.add_argument("--json", help="also write the raw results to this file")
+    parser.add_argument("--data-dir", help="keep caches, run records and artifacts here (default: a temporary directory)")
+    args = parser.parse_args()
+
+    results = asyncio.run(run_benchmark(args.runs, args.cold, args.latency_ms, args.jitter_ms, args.free_slots, args.data_dir))
+    print_report(results)
+    if args.json:
+        os.makedirs(os.path.dirname(args.json) or ".", exist_ok=True)
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
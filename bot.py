@@ -1,14 +1,31 @@
 import asyncio
+import gzip
+import hashlib
+import http.client
+import json
 import os
+import random
 import sys
 import re
+import time
+import unicodedata
 from datetime import datetime
+from urllib.parse import urljoin, urlparse
 from playwright.async_api import async_playwright
 
 # Load environment variables from .env file
 from dotenv import load_dotenv
 load_dotenv()
 
+def env_flag(name, default=False):
+    """
+    Reads a boolean switch from the environment (1/true/yes/on).
+    """
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
 # Configuration from .env
 FIRST_NAME = os.getenv("FIRST_NAME")
 LAST_NAME = os.getenv("LAST_NAME")
@@ -18,392 +35,2548 @@ STUDENT_ID = os.getenv("STUDENT_ID")
 # Use the TARGET_URL from .env if available, or default to the hardcoded one
 TARGET_URL = os.getenv("TARGET_URL", "https://calendar.google.com/calendar/u/0/appointments/schedules/AcZssZ0oKeF_jNFvpWsuV4dtKOF4pHwOMZdVkAzTWsh_z3n2WNZsKOGuX3AUILZAuQ8y-FdfBwe_UPS-")
 
-def get_screenshot_path(name_suffix):
+# Set SLOT_SCAN_COMPARE=1 to time the in-page scanner against the legacy per-element loop
+SLOT_SCAN_COMPARE = env_flag("SLOT_SCAN_COMPARE")
+# How to decide the slot list is ready: "slot" (first usable slot seen by a DOM observer) or "networkidle" (legacy)
+READY_MODE = os.getenv("READY_MODE", "slot").lower()
+# Upper bound on waiting for the page to show slot buttons
+READY_TIMEOUT_MS = int(os.getenv("READY_TIMEOUT_MS", "60000"))
+# In "slot" mode, treat the page as settled with no usable slot after this long without DOM changes
+READY_QUIET_MS = int(os.getenv("READY_QUIET_MS", "1500"))
+# Optional Chromium binary to use instead of the one installed by `playwright install`
+CHROMIUM_EXECUTABLE_PATH = os.getenv("CHROMIUM_EXECUTABLE_PATH")
+# Chromium launch arguments, whitespace separated; replaces DEFAULT_LAUNCH_ARGS when set
+LAUNCH_ARGS = os.getenv("LAUNCH_ARGS", "")
+# Browser context viewport (WIDTHxHEIGHT) and device scale factor
+VIEWPORT = os.getenv("VIEWPORT", "1280x800")
+DEVICE_SCALE_FACTOR = float(os.getenv("DEVICE_SCALE_FACTOR", "2"))
+
+# Plain HTTP pre-check that skips the browser when the target looks unchanged
+PROBE_ENABLED = env_flag("PROBE_ENABLED")
+# What to fetch (defaults to TARGET_URL); point it at the availability endpoint if there is one
+PROBE_URL = os.getenv("PROBE_URL", "")
+# Optional regex; only its matches are hashed instead of the whole normalized body
+PROBE_PATTERN = os.getenv("PROBE_PATTERN", "")
+PROBE_TIMEOUT_SECONDS = float(os.getenv("PROBE_TIMEOUT_SECONDS", "10"))
+# Run the browser anyway after this many skips in a row
+PROBE_MAX_SKIPS = int(os.getenv("PROBE_MAX_SKIPS", "4"))
+
+# Daemon mode (python bot.py --daemon)
+DAEMON_INTERVAL_SECONDS = int(os.getenv("DAEMON_INTERVAL_SECONDS", "900"))
+DAEMON_RECYCLE_RUNS = int(os.getenv("DAEMON_RECYCLE_RUNS", "20"))
+DAEMON_MAX_RSS_MB = int(os.getenv("DAEMON_MAX_RSS_MB", "1024"))
+# 0 runs forever
+DAEMON_MAX_RUNS = int(os.getenv("DAEMON_MAX_RUNS", "0"))
+DAEMON_STOP_ON_SUCCESS = env_flag("DAEMON_STOP_ON_SUCCESS", True)
+
+# Where learned state (resource sizes, caches) is kept between runs
+CACHE_DIR = os.getenv("CACHE_DIR", ".cache")
+
+# How many weeks of slots to index, starting with the one shown first
+SLOT_INDEX_WEEKS = int(os.getenv("SLOT_INDEX_WEEKS", "1"))
+# Longest wait for another week to render after clicking next/previous week
+WEEK_CHANGE_TIMEOUT_MS = int(os.getenv("WEEK_CHANGE_TIMEOUT_MS", "3000"))
+# Preferred time windows, e.g. "09:00-12:00,13:00-16:30" (empty accepts any time)
+SLOT_TIME_WINDOWS = os.getenv("SLOT_TIME_WINDOWS", "")
+# Preferred weekdays, e.g. "mon,tue,thu" (empty accepts any day)
+SLOT_WEEKDAYS = os.getenv("SLOT_WEEKDAYS", "")
+
+# Resource policy for page loads: "off", "block" (drop what matches below) or "allowlist" (drop everything not allowed)
+BLOCK_MODE = os.getenv("BLOCK_MODE", "block").lower()
+# Playwright resource types to abort, e.g. image,font,media,stylesheet
+BLOCK_RESOURCE_TYPES = os.getenv("BLOCK_RESOURCE_TYPES", "image,font,media")
+# Resource types answered with an empty 200 instead of being aborted
+STUB_RESOURCE_TYPES = os.getenv("STUB_RESOURCE_TYPES", "")
+# Comma separated URL regexes to abort (telemetry beacons by default)
+BLOCK_URL_PATTERNS = os.getenv("BLOCK_URL_PATTERNS", r"play\.google\.com/log,/gen_204,google-analytics\.com,googletagmanager\.com,doubleclick\.net")
+# In allowlist mode only these URL regexes load (defaults to the target's host)
+ALLOW_URL_PATTERNS = os.getenv("ALLOW_URL_PATTERNS", "")
+# Fraction of skipped image/font/media requests of unknown size fetched once outside the page, so savings can be estimated
+BLOCK_SAMPLE_RATE = float(os.getenv("BLOCK_SAMPLE_RATE", "0.1"))
+# Never scripts, XHR or beacons: sampling must not change what the page or the site sees
+SAMPLE_RESOURCE_TYPES = {"image", "font", "media"}
+
+# Where screenshots, page sources and traces go, in dated folders
+RESULTS_DIR = os.getenv("RESULTS_DIR", "results")
+# One JSON line per run with phase durations, outcome and request counts (empty disables)
+RUN_LOG_PATH = os.getenv("RUN_LOG_PATH", os.path.join(RESULTS_DIR, "runs.jsonl"))
+# Capture a Playwright trace and keep it only when a run takes longer than this (0 disables)
+TRACE_SLOW_RUNS_MS = int(os.getenv("TRACE_SLOW_RUNS_MS", "0"))
+# Total time a single run may take; each phase also has its own budget inside it
+RUN_DEADLINE_MS = int(os.getenv("RUN_DEADLINE_MS", "120000"))
+# Per-phase budgets, e.g. "confirm=20000,settle=2000" (unlisted phases keep the defaults)
+PHASE_BUDGETS_MS = os.getenv("PHASE_BUDGETS_MS", "")
+# How long the physical submit click holds the mouse button down
+CLICK_HOLD_MS = int(os.getenv("CLICK_HOLD_MS", "0"))
+
+# "batch" fills every field in one in-page evaluation; "locator" uses Playwright fill() per resolved field
+FORM_FILL_MODE = os.getenv("FORM_FILL_MODE", "batch").lower()
+# Extra form fields as JSON {"label regex": "value"}, e.g. {"คณะ|Faculty": "Engineering"}
+EXTRA_FIELDS = os.getenv("EXTRA_FIELDS", "")
+
+# Screenshots and page dumps: "all", "failure-only" (nothing for successful polls) or "off"
+ARTIFACT_MODE = os.getenv("ARTIFACT_MODE", "all").lower()
+# "jpeg" or "png"; quality only applies to jpeg
+ARTIFACT_FORMAT = os.getenv("ARTIFACT_FORMAT", "jpeg").lower()
+ARTIFACT_QUALITY = int(os.getenv("ARTIFACT_QUALITY", "70"))
+# "css" captures at 1x instead of the context's device_scale_factor ("device")
+ARTIFACT_SCALE = os.getenv("ARTIFACT_SCALE", "css").lower()
+ARTIFACT_FULL_PAGE = env_flag("ARTIFACT_FULL_PAGE")
+# Retention for results/YYYY-MM-DD/ (0 disables each limit)
+ARTIFACT_MAX_AGE_DAYS = int(os.getenv("ARTIFACT_MAX_AGE_DAYS", "7"))
+ARTIFACT_MAX_TOTAL_MB = int(os.getenv("ARTIFACT_MAX_TOTAL_MB", "200"))
+
+# POST/PUT responses whose URL matches this are treated as the booking request.
+# Keep it narrower than the appointment page itself, whose logging and RPC calls share its path.
+CONFIRM_URL_PATTERN = os.getenv("CONFIRM_URL_PATTERN", r"/api/book\b|/book(ing)?\b(?!.*/(log|jserror)\b)")
+# A 2xx booking response only counts as confirmed when its body matches this
+CONFIRM_SUCCESS_PATTERN = os.getenv("CONFIRM_SUCCESS_PATTERN", r'"(status|result)"\s*:\s*"(confirmed|success|booked|ok)"|"booking_?id"\s*:|ยืนยันการจองแล้ว|การจองได้รับการยืนยัน|Booking confirmed')
+# A booking response body matching this means the booking was refused even with a 2xx status
+CONFIRM_ERROR_PATTERN = os.getenv("CONFIRM_ERROR_PATTERN", r'"(status|result)"\s*:\s*"(rejected|error|failed)"|"error"\s*:|ถูกจองแล้ว|no longer available|not available')
+
+# Submit strategies that fail this many times in a row on a target are tried last
+SUBMIT_EVICT_AFTER = int(os.getenv("SUBMIT_EVICT_AFTER", "3"))
+
+# Several targets in one browser: a JSON file listing them (see README)
+TARGETS_FILE = os.getenv("TARGETS_FILE", "")
+# How many targets are checked at the same time
+TARGETS_CONCURRENCY = int(os.getenv("TARGETS_CONCURRENCY", "2"))
+# Minimum gap between page loads to the same host
+TARGETS_HOST_INTERVAL_MS = int(os.getenv("TARGETS_HOST_INTERVAL_MS", "2000"))
+
+# Step-level retries: how often a failed step is retried before the run gives up
+STEP_RETRIES = int(os.getenv("STEP_RETRIES", "2"))
+# Base delay before a retry, doubled per attempt with random jitter
+STEP_BACKOFF_MS = int(os.getenv("STEP_BACKOFF_MS", "500"))
+
+def slugify(name):
     """
-    Generates a file path for screenshots organized by Date/Time.
-    Format: results/YYYY-MM-DD/HH-MM-SS_name_suffix.png
+    Turns a target name (or URL) into something safe for a file name. Letters
+    in any script are kept, and a short hash of the name keeps distinct names
+    from sharing a slug.
+    """
+    # Thai vowel and tone marks are combining characters, not alphanumerics
+    chars = [c if c.isalnum() or unicodedata.category(c).startswith("M") else "-" for c in name.lower()]
+    slug = re.sub(r"-+", "-", "".join(chars)).strip("-")[:40]
+    digest = hashlib.sha1(name.encode("utf-8")).hexdigest()[:6]
+    return f"{slug}-{digest}" if slug else digest
+
+def get_result_path(name_suffix, extension, tag=None):
+    """
+    Generates a file path for run artifacts organized by Date/Time.
+    Format: results/YYYY-MM-DD/HH-MM-SS[_tag]_name_suffix.extension (under RESULTS_DIR)
+    The tag (a slugified target name) keeps concurrent targets apart.
     """
     now = datetime.now()
     # Create folder for "Today's Date" inside results/
     date_folder = now.strftime("%Y-%m-%d")
-    base_dir = os.path.join("results", date_folder)
+    base_dir = os.path.join(RESULTS_DIR, date_folder)
     
     # Ensure directory exists
     os.makedirs(base_dir, exist_ok=True)
     
     # File name with Time
     time_str = now.strftime("%H-%M-%S")
-    filename = f"{time_str}_{name_suffix}.png"
+    if tag:
+        time_str = f"{time_str}_{tag}"
+    filename = f"{time_str}_{name_suffix}.{extension}"
     
-    full_path = os.path.join(base_dir, filename)
-    print(f"Saving screenshot to: {full_path}")
-    return full_path
+    return os.path.join(base_dir, filename)
 
-async def book_appointment():
-    # Helper to check environment variables
-    if not all([FIRST_NAME, LAST_NAME, EMAIL, PHONE, STUDENT_ID]):
-        print("Error: Missing environment variables. Please check your .env file.")
-        sys.exit(1)
+def write_artifact(path, data, compress=False):
+    if compress:
+        data = gzip.compress(data)
+    with open(path, "wb") as f:
+        f.write(data)
 
-    async with async_playwright() as p:
-        # Set locale to Thai to match user's screenshot and expectations
-        # Add arguments to make the browser look more like a real user and less like a bot
-        browser = await p.chromium.launch(
-            headless=True,
-            args=[
-                '--disable-blink-features=AutomationControlled',
-                '--disable-features=IsolateOrigins,site-per-process', # Helps with iframes sometimes
-                '--use-fake-ui-for-media-stream',
-                '--no-sandbox',
-                '--disable-setuid-sandbox',
-            ]
-        )
-        
-        # Create context with more realistic user agent and viewport
-        context = await browser.new_context(
-            locale='th-TH',
-            user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            viewport={'width': 1280, 'height': 800},
-            device_scale_factor=2,
+def enforce_retention(results_dir=None):
+    """
+    Deletes dated artifact files older than ARTIFACT_MAX_AGE_DAYS, then the
+    oldest ones until results/YYYY-MM-DD/ fits in ARTIFACT_MAX_TOTAL_MB.
+    Files directly under results/ (such as the run log) are left alone.
+    """
+    results_dir = results_dir or RESULTS_DIR
+    if not os.path.isdir(results_dir):
+        return
+    files = []
+    for folder in os.listdir(results_dir):
+        folder_path = os.path.join(results_dir, folder)
+        if not os.path.isdir(folder_path):
+            continue
+        for name in os.listdir(folder_path):
+            path = os.path.join(folder_path, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+    files.sort()
+
+    now = time.time()
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    for mtime, size, path in files:
+        too_old = ARTIFACT_MAX_AGE_DAYS and now - mtime > ARTIFACT_MAX_AGE_DAYS * 86400
+        too_big = ARTIFACT_MAX_TOTAL_MB and total > ARTIFACT_MAX_TOTAL_MB * 1024 * 1024
+        if not (too_old or too_big):
+            continue
+        try:
+            os.remove(path)
+            total -= size
+            removed += 1
+        except OSError:
+            pass
+
+    for folder in os.listdir(results_dir):
+        folder_path = os.path.join(results_dir, folder)
+        if os.path.isdir(folder_path) and not os.listdir(folder_path):
+            os.rmdir(folder_path)
+    if removed:
+        print(f"Artifact retention removed {removed} old files.")
+
+class ArtifactWriter:
+    """
+    Captures screenshots and page dumps off the critical path: captures run
+    as background tasks and file writes (and gzip for HTML) happen in a
+    worker thread. drain() waits for everything before the page closes.
+    """
+
+    def __init__(self, page, tag=None):
+        self.page = page
+        self.tag = tag
+        self.tasks = []
+        self.paths = []
+
+    def wanted(self, failure):
+        if ARTIFACT_MODE == "off":
+            return False
+        if ARTIFACT_MODE == "failure-only":
+            return failure
+        return True
+
+    def screenshot(self, name_suffix, failure=False):
+        if self.wanted(failure):
+            self.tasks.append(asyncio.ensure_future(self._screenshot(name_suffix)))
+
+    def page_source(self, name_suffix, failure=True):
+        if self.wanted(failure):
+            self.tasks.append(asyncio.ensure_future(self._page_source(name_suffix)))
+
+    async def _screenshot(self, name_suffix):
+        options = {"full_page": ARTIFACT_FULL_PAGE, "scale": "css" if ARTIFACT_SCALE == "css" else "device"}
+        if ARTIFACT_FORMAT == "jpeg":
+            options.update(type="jpeg", quality=ARTIFACT_QUALITY)
+            extension = "jpg"
+        else:
+            options.update(type="png")
+            extension = "png"
+        data = await self.page.screenshot(**options)
+        path = get_result_path(name_suffix, extension, self.tag)
+        await asyncio.get_running_loop().run_in_executor(None, write_artifact, path, data)
+        self.paths.append(path)
+        print(f"Saved screenshot to: {path}")
+
+    async def _page_source(self, name_suffix):
+        html = await self.page.content()
+        path = get_result_path(name_suffix, "html.gz", self.tag)
+        await asyncio.get_running_loop().run_in_executor(None, write_artifact, path, html.encode("utf-8"), True)
+        self.paths.append(path)
+        print(f"Saved page source to: {path}")
+
+    async def drain(self):
+        results = await asyncio.gather(*self.tasks, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"Could not save artifact: {result}")
+        self.tasks = []
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, enforce_retention)
+        except OSError as e:
+            print(f"Artifact retention failed: {e}")
+        return self.paths
+
+# Selector for anything that may be a time slot button
+SLOT_CANDIDATE_SELECTOR = 'div[role="button"], button'
+
+# Runs inside the page: tags every candidate with a stable data attribute and
+# returns its text, label, visibility and aria state in one round trip.
+# Visibility mirrors Playwright's is_visible(): a non-empty box and not visibility:hidden.
+SLOT_SCAN_JS = """selector => {
+    const rows = [];
+    document.querySelectorAll(selector).forEach((el, index) => {
+        el.setAttribute('data-bot-slot', String(index));
+        const rect = el.getBoundingClientRect();
+        const style = window.getComputedStyle(el);
+        const visible = rect.width > 0 && rect.height > 0 && style.visibility !== 'hidden';
+        rows.push({
+            handle: String(index),
+            text: visible ? el.innerText : '',
+            label: el.getAttribute('aria-label') || '',
+            visible: visible,
+            disabled: el.getAttribute('aria-disabled'),
+            hidden: el.getAttribute('aria-hidden'),
+        });
+    });
+    return rows;
+}"""
+
+async def scan_slots(page):
+    """
+    Returns a compact slot table for every clickable candidate on the page.
+    Each row: handle, text, label, visible, disabled, hidden.
+    """
+    return await page.evaluate(SLOT_SCAN_JS, SLOT_CANDIDATE_SELECTOR)
+
+def slot_locator(page, slot):
+    """
+    Resolves a row from scan_slots() back to a clickable locator.
+    """
+    return page.locator(f'[data-bot-slot="{slot["handle"]}"]')
+
+async def scan_slots_legacy(page):
+    """
+    The original per-element scan (one CDP round trip per call per element).
+    Kept for timing comparisons only.
+    """
+    rows = []
+    for slot in await page.locator(SLOT_CANDIDATE_SELECTOR).all():
+        visible = await slot.is_visible()
+        rows.append({
+            "text": await slot.inner_text() if visible else "",
+            "label": await slot.get_attribute("aria-label") or "",
+            "visible": visible,
+            "disabled": await slot.get_attribute("aria-disabled"),
+            "hidden": await slot.get_attribute("aria-hidden"),
+        })
+    return rows
+
+# Matches 9:00, 09:00, 9:00am, 9:00 PM, 9:00 น. etc.
+SLOT_TIME = re.compile(r"(\d{1,2}):(\d{2})\s*(am|pm|a\.m\.|p\.m\.)?", re.IGNORECASE)
+
+MONTHS = {name: number for number, names in enumerate([
+    ("january", "jan", "มกราคม", "ม.ค."),
+    ("february", "feb", "กุมภาพันธ์", "ก.พ."),
+    ("march", "mar", "มีนาคม", "มี.ค."),
+    ("april", "apr", "เมษายน", "เม.ย."),
+    ("may", "พฤษภาคม", "พ.ค."),
+    ("june", "jun", "มิถุนายน", "มิ.ย."),
+    ("july", "jul", "กรกฎาคม", "ก.ค."),
+    ("august", "aug", "สิงหาคม", "ส.ค."),
+    ("september", "sep", "sept", "กันยายน", "ก.ย."),
+    ("october", "oct", "ตุลาคม", "ต.ค."),
+    ("november", "nov", "พฤศจิกายน", "พ.ย."),
+    ("december", "dec", "ธันวาคม", "ธ.ค."),
+], start=1) for name in names}
+
+# Longest names first so "กรกฎาคม" wins over a shorter prefix
+MONTH_NAMES = "|".join(re.escape(name) for name in sorted(MONTHS, key=len, reverse=True))
+DAY_MONTH = re.compile(rf"(\d{{1,2}})\s*(?:ที่\s*)?({MONTH_NAMES})", re.IGNORECASE)
+MONTH_DAY = re.compile(rf"({MONTH_NAMES})\s+(\d{{1,2}})", re.IGNORECASE)
+# A year written right after the day and month ("21 ตุลาคม 2568", "October 21, 2025")
+YEAR_AFTER_DATE = re.compile(r"\s*,?\s*(?:พ\.ศ\.|ค\.ศ\.)?\s*(\d{4})\b")
+
+WEEKDAY_NAMES = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+NEXT_WEEK_LABEL = re.compile(r"สัปดาห์ถัดไป|ถัดไป|Next week|Next period|Next", re.IGNORECASE)
+PREVIOUS_WEEK_LABEL = re.compile(r"สัปดาห์ก่อนหน้า|ก่อนหน้า|Previous week|Previous period|Previous", re.IGNORECASE)
+
+SLOT_INDEX_PATH = os.path.join(CACHE_DIR, "slot_index.json")
+
+# What identifies the week on screen: the headings (day columns, date range)
+# plus the labels of the time slots. Other buttons (week controls, menus) stay
+# the same from week to week, so they are left out.
+WEEK_SIGNATURE_JS = """selector => {
+    const headings = Array.from(document.querySelectorAll('h1, h2, h3, h4, [role="heading"]'))
+        .map(el => el.textContent.trim());
+    const slots = Array.from(document.querySelectorAll(selector))
+        .map(el => el.getAttribute('aria-label') || el.textContent)
+        .filter(text => /\\d{1,2}:\\d{2}/.test(text));
+    return headings.concat(slots).join('|');
+}"""
+
+def parse_slot_time(text):
+    """
+    Returns "HH:MM" (24h) for the first time in the text, or None.
+    """
+    match = SLOT_TIME.search(text)
+    if not match:
+        return None
+    hour, minute = int(match.group(1)), int(match.group(2))
+    meridiem = (match.group(3) or "").lower().replace(".", "")
+    if meridiem == "pm" and hour < 12:
+        hour += 12
+    elif meridiem == "am" and hour == 12:
+        hour = 0
+    return f"{hour:02d}:{minute:02d}"
+
+def parse_slot_date(text, today=None):
+    """
+    Returns the ISO date in a slot label ("21 ตุลาคม", "October 21", ...).
+    Without a year, the nearest date that isn't long past is used.
+    """
+    today = today or datetime.now().date()
+    # Drop times first so "10:00" can't be read as a day
+    text = SLOT_TIME.sub(" ", text)
+    match = DAY_MONTH.search(text)
+    if match:
+        day, month = int(match.group(1)), MONTHS[match.group(2).lower()]
+    else:
+        match = MONTH_DAY.search(text)
+        if not match:
+            return None
+        day, month = int(match.group(2)), MONTHS[match.group(1).lower()]
+
+    year = None
+    year_match = YEAR_AFTER_DATE.match(text, match.end())
+    if year_match:
+        year = int(year_match.group(1))
+        # Thai labels may use the Buddhist era
+        if year > 2400:
+            year -= 543
+        # Room numbers and the like aren't years
+        if not 2000 <= year <= 2100:
+            year = None
+    if year is None:
+        year = today.year
+        # A month well before the current one belongs to next year
+        if month < today.month - 1:
+            year += 1
+    try:
+        return datetime(year, month, day).date().isoformat()
+    except ValueError:
+        return None
+
+def slot_record(row, week):
+    """
+    Turns a scan_slots() row into a structured slot record, or None if the
+    row isn't a time slot.
+    """
+    source = f"{row['label']} {row['text']}"
+    slot_time = parse_slot_time(row["label"]) or parse_slot_time(row["text"])
+    if not row["visible"] or slot_time is None:
+        return None
+    slot_date = parse_slot_date(source)
+    key = f"{slot_date}T{slot_time}" if slot_date else f"week{week}:{row['label'] or row['text']}"
+    return {
+        "key": key,
+        "date": slot_date,
+        "time": slot_time,
+        "week": week,
+        "label": row["label"],
+        "text": row["text"].strip(),
+        "enabled": row["disabled"] != "true" and row["hidden"] != "true",
+        "handle": row["handle"],
+    }
+
+async def change_week(page, pattern, timer):
+    """
+    Clicks the next/previous week control and waits up to WEEK_CHANGE_TIMEOUT_MS
+    for another week to render. Returns False if there is no usable control.
+    A clicked control counts as a move even if the week looks the same, as two
+    weeks without any slots do.
+    """
+    button = await first_visible(page.get_by_role("button", name=pattern))
+    if button is None or not await button.is_enabled() or await button.get_attribute("aria-disabled") == "true":
+        return False
+    before = await page.evaluate(WEEK_SIGNATURE_JS, SLOT_CANDIDATE_SELECTOR)
+    await button.click()
+    try:
+        await page.wait_for_function(
+            f"before => ({WEEK_SIGNATURE_JS})({json.dumps(SLOT_CANDIDATE_SELECTOR)}) !== before",
+            arg=before, timeout=timer.remaining_ms(WEEK_CHANGE_TIMEOUT_MS),
         )
-        
-        # Hide the webdriver property
-        await context.add_init_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
-        
-        page = await context.new_page()
+    except Exception:
+        print("The week looks the same after the click; carrying on.")
+    return True
 
+async def scan_weeks(page, timer):
+    """
+    Scans the shown week and walks forward SLOT_INDEX_WEEKS - 1 more.
+    Returns (records, page_week): the week the page is left on, 0 being the first.
+    """
+    records = []
+    seen = set()
+    page_week = 0
+    for week in range(max(1, SLOT_INDEX_WEEKS)):
+        if week > 0:
+            if not await change_week(page, NEXT_WEEK_LABEL, timer):
+                print(f"Could not move past week {week}.")
+                break
+            page_week = week
+        # Collect every clickable candidate in a single in-page evaluation
+        # instead of awaiting is_visible/inner_text/get_attribute per element.
+        rows = await scan_slots(page)
+        print(f"Week {week + 1}: found {len(rows)} potential clickable elements. Checking for time slots...")
+        for row in rows:
+            record = slot_record(row, week)
+            if record is None or record["key"] in seen:
+                continue
+            seen.add(record["key"])
+            records.append(record)
+            print(f"Found time slot candidate: '{record['text']}' (Label: '{record['label']}') - Enabled: {record['enabled']}")
+    return records, page_week
+
+def diff_slot_index(previous, records):
+    """
+    Compares this poll with the stored index: keys of new, removed and
+    newly enabled slots. Without a previous index nothing counts as new.
+    """
+    if previous is None:
+        return {"new": [], "removed": [], "newly_enabled": []}
+    current = {r["key"]: r for r in records}
+    return {
+        "new": [key for key in current if key not in previous],
+        "removed": [key for key in previous if key not in current],
+        "newly_enabled": [
+            key for key, r in current.items()
+            if r["enabled"] and key in previous and not previous[key].get("enabled")
+        ],
+    }
+
+def parse_window_time(text):
+    """
+    "HH:MM" for a window bound: a time like parse_slot_time() reads, or a bare hour ("9").
+    """
+    text = text.strip()
+    if text.isdigit():
+        text += ":00"
+    slot_time = parse_slot_time(text)
+    if slot_time is None or slot_time > "24:00" or slot_time[3:] >= "60":
+        raise ValueError(f"'{text}' is not a time")
+    return slot_time
+
+def parse_time_windows(value):
+    """
+    Parses SLOT_TIME_WINDOWS ("09:00-12:00,13:00-16:30", or a JSON list of
+    such strings) into [(start, end)] pairs of "HH:MM". Raises ValueError
+    naming the bad entry.
+    """
+    windows = []
+    for window in value if isinstance(value, list) else split_list(value):
+        start, dash, end = window.partition("-")
         try:
-            print(f"Navigating to {TARGET_URL}...")
-            await page.goto(TARGET_URL)
+            if not dash:
+                raise ValueError("expected START-END")
+            windows.append((parse_window_time(start), parse_window_time(end)))
+        except ValueError as e:
+            raise ValueError(f"bad slot time window '{window}': {e}") from None
+    return windows
+
+def parse_weekdays(value):
+    """
+    Parses SLOT_WEEKDAYS ("mon,tue", full names work too) into WEEKDAY_NAMES entries.
+    """
+    weekdays = []
+    for day in value if isinstance(value, list) else split_list(value):
+        name = day.strip().lower()[:3]
+        if name not in WEEKDAY_NAMES:
+            raise ValueError(f"bad slot weekday '{day}'")
+        weekdays.append(name)
+    return weekdays
+
+def slot_matches_preferences(record, target):
+    if target.time_windows and not any(start <= record["time"] <= end for start, end in target.time_windows):
+        return False
+    if target.weekdays and record["date"]:
+        if WEEKDAY_NAMES[datetime.fromisoformat(record["date"]).weekday()] not in target.weekdays:
+            return False
+    return True
+
+def choose_slot(records, diff, target):
+    """
+    Picks the best enabled slot within the target's preferences: slots that are new
+    or newly enabled since the last poll first, then the earliest.
+    """
+    fresh = set(diff["new"]) | set(diff["newly_enabled"])
+    candidates = [r for r in records if r["enabled"] and slot_matches_preferences(r, target)]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda r: (r["key"] not in fresh, r["date"] or "9999", r["time"], r["week"]))
+
+async def locate_indexed_slot(page, record, page_week, timer):
+    """
+    Goes back from `page_week` to the week a chosen slot is on and returns its locator.
+    """
+    for _ in range(page_week - record["week"]):
+        if not await change_week(page, PREVIOUS_WEEK_LABEL, timer):
+            print("Could not go back to the selected week.")
+            return None
+    if page_week == record["week"]:
+        return slot_locator(page, record)
+    # Handles are re-issued on every scan, so find the slot again by key
+    for row in await scan_slots(page):
+        again = slot_record(row, record["week"])
+        if again and again["key"] == record["key"] and again["enabled"]:
+            return slot_locator(page, again)
+    return None
+
+async def compare_slot_scans(page):
+    """
+    Prints how long the in-page scanner takes compared with the legacy loop.
+    """
+    start = time.perf_counter()
+    fast = await scan_slots(page)
+    fast_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    slow = await scan_slots_legacy(page)
+    slow_ms = (time.perf_counter() - start) * 1000
+
+    speedup = slow_ms / fast_ms if fast_ms else 0
+    print(f"Slot scan timing: in-page {fast_ms:.1f} ms ({len(fast)} rows) vs legacy loop {slow_ms:.1f} ms ({len(slow)} rows), {speedup:.1f}x faster")
+
+# Installed as an init script in "slot" readiness mode. A MutationObserver
+# re-checks the candidates after each batch of DOM changes and pushes every
+# newly usable time slot to Python through the exposed __botSlotEvent binding.
+# Once a time slot has rendered (usable or not) and the DOM stays quiet for
+# quietMs, it reports "quiet" so a page with no free slots does not have to
+# run into the full timeout. Header and navigation buttons render before the
+# availability request returns, so they don't start the quiet timer.
+SLOT_WATCH_JS = """(() => {
+    const selector = %s;
+    const quietMs = %d;
+    const timePattern = /\\d{1,2}:\\d{2}/;
+    const reported = new WeakSet();
+    let scheduled = false;
+    let quietTimer = null;
+    let quietSent = false;
+    let slotSeen = false;
+
+    const send = payload => {
+        if (typeof window.__botSlotEvent === 'function') {
+            window.__botSlotEvent(payload).catch(() => {});
+        }
+    };
+
+    const check = () => {
+        scheduled = false;
+        const candidates = document.querySelectorAll(selector);
+        candidates.forEach(el => {
+            if (reported.has(el)) return;
+            const label = el.getAttribute('aria-label') || '';
+            const text = el.textContent || '';
+            if (!timePattern.test(text) && !timePattern.test(label)) return;
+            slotSeen = true;
+            if (el.getAttribute('aria-disabled') === 'true' || el.getAttribute('aria-hidden') === 'true') return;
+            const rect = el.getBoundingClientRect();
+            if (rect.width === 0 || rect.height === 0) return;
+            reported.add(el);
+            send({type: 'slot', text: text.trim(), label: label, at: performance.now()});
+        });
+        if (!quietSent && slotSeen) {
+            clearTimeout(quietTimer);
+            quietTimer = setTimeout(() => {
+                quietSent = true;
+                send({type: 'quiet', candidates: document.querySelectorAll(selector).length, at: performance.now()});
+            }, quietMs);
+        }
+    };
+
+    const schedule = () => {
+        if (!scheduled) {
+            scheduled = true;
+            setTimeout(check, 0);
+        }
+    };
+
+    new MutationObserver(schedule).observe(document, {
+        childList: true,
+        subtree: true,
+        attributes: true,
+        attributeFilter: ['aria-disabled', 'aria-hidden', 'aria-label', 'style', 'class'],
+    });
+    document.addEventListener('DOMContentLoaded', schedule);
+})()"""
+
+class SlotWatcher:
+    """
+    Receives slot appearances pushed from SLOT_WATCH_JS and lets the flow
+    wait for the first usable slot (or a quiet page) instead of networkidle.
+    """
+
+    def __init__(self):
+        self.slots = []
+        self.first_slot_at = None
+        self.started_at = None
+        self._ready = asyncio.Event()
+        self.reason = None
+
+    async def install(self, page):
+        await page.expose_function("__botSlotEvent", self._on_event)
+        await page.add_init_script(SLOT_WATCH_JS % (json.dumps(SLOT_CANDIDATE_SELECTOR), READY_QUIET_MS))
+
+    def start(self):
+        # Call right before navigation so time-to-first-slot covers the page load;
+        # a repeated navigation starts from a clean slate
+        self.started_at = time.perf_counter()
+        self.slots = []
+        self.first_slot_at = None
+        self._ready.clear()
+        self.reason = None
+
+    def _on_event(self, event):
+        if event.get("type") == "slot":
+            self.slots.append(event)
+            if self.first_slot_at is None:
+                self.first_slot_at = time.perf_counter()
+                self._set_ready("slot")
+        elif event.get("type") == "quiet":
+            self._set_ready("quiet")
+
+    def _set_ready(self, reason):
+        if not self._ready.is_set():
+            self.reason = reason
+            self._ready.set()
+
+    async def wait(self, timeout_ms, page=None):
+        """
+        Returns "slot", "quiet", "idle" or "timeout". With a page, reaching
+        network idle and then READY_QUIET_MS without any slot also ends the
+        wait ("idle"), for pages that render no time slots at all.
+        """
+        deadline = time.perf_counter() + timeout_ms / 1000
+        ready = asyncio.ensure_future(self._ready.wait())
+        pending = {ready}
+        if page is not None:
+            pending.add(asyncio.ensure_future(page.wait_for_load_state("networkidle", timeout=timeout_ms)))
+        try:
+            while not ready.done():
+                done, pending = await asyncio.wait(pending, timeout=max(0, deadline - time.perf_counter()), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.reason = "timeout"
+                    break
+                if ready in done or any(task.exception() is not None for task in done):
+                    continue
+                # Network idle: give the page READY_QUIET_MS to render what it fetched
+                try:
+                    await asyncio.wait_for(asyncio.shield(ready), min(READY_QUIET_MS / 1000, max(0, deadline - time.perf_counter())))
+                except asyncio.TimeoutError:
+                    self._set_ready("idle")
+        finally:
+            for task in pending | {ready}:
+                task.cancel()
+        return self.reason
+
+    def time_to_first_slot_ms(self):
+        if self.first_slot_at is None or self.started_at is None:
+            return None
+        return (self.first_slot_at - self.started_at) * 1000
+
+async def wait_for_slots_ready(page, watcher, timer, artifacts):
+    """
+    Waits until the slot list is usable according to READY_MODE,
+    within READY_TIMEOUT_MS and the "ready" phase budget.
+    """
+    if watcher is not None:
+        reason = await watcher.wait(timer.remaining_ms(READY_TIMEOUT_MS), page)
+        if reason == "slot":
+            print(f"First usable slot appeared after {watcher.time_to_first_slot_ms():.0f} ms: '{watcher.slots[0]['text']}'")
+        elif reason == "quiet":
+            print(f"Page settled without a usable slot (quiet for {READY_QUIET_MS} ms).")
+        elif reason == "idle":
+            print(f"Network went idle and no time slot rendered within {READY_QUIET_MS} ms.")
+        else:
+            print("Timeout waiting for page content.")
+            artifacts.screenshot("page_load_timeout", failure=True)
+        return
+
+    # Legacy readiness: any button, then network idle
+    try:
+        # Wait for any button to load which indicates interactivity
+        await page.wait_for_selector(SLOT_CANDIDATE_SELECTOR, timeout=timer.remaining_ms(READY_TIMEOUT_MS))
+    except:
+        print("Timeout waiting for page content.")
+        artifacts.screenshot("page_load_timeout", failure=True)
+
+    # Wait for network idle to ensure slots are loaded
+    try:
+        await page.wait_for_load_state('networkidle', timeout=timer.remaining_ms(READY_TIMEOUT_MS))
+    except:
+        pass
+
+def split_list(value):
+    """
+    Splits a comma separated .env value into a list of non-empty items.
+    """
+    return [item.strip() for item in (value or "").split(",") if item.strip()]
+
+def load_json(path, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+def save_json(path, data):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # Write then rename so an interrupted run never leaves a truncated file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+# Personal details every target's form needs
+PERSON_FIELDS = ["first_name", "last_name", "email", "phone", "student_id"]
+
+class Target:
+    """
+    One booking page, the details to book it with and the slot preferences.
+    A single run builds it from the environment (default_target); with
+    TARGETS_FILE there is one per entry. Targets with the same `person`
+    (the email address unless given) stand in for each other: one
+    confirmed booking is enough.
+    """
+
+    def __init__(self, url, fields, name=None, person=None, extra_fields=None, time_windows="", weekdays=""):
+        self.url = url
+        self.fields = fields
+        self.name = name or url
+        self.person = person or (fields.get("email") or "").lower()
+        self.extra_fields = extra_fields or {}
+        # Validated here so a typo fails the config check instead of every scan
+        self.time_windows = parse_time_windows(time_windows)
+        self.weekdays = parse_weekdays(weekdays)
+
+    def missing_fields(self):
+        return [name for name in PERSON_FIELDS if not self.fields.get(name)]
+
+def parse_extra_fields(value):
+    if not value:
+        return {}
+    try:
+        return json.loads(value)
+    except ValueError:
+        print("EXTRA_FIELDS is not valid JSON, ignoring it.")
+        return {}
+
+def default_target():
+    """
+    The target described by TARGET_URL, FIRST_NAME... and the SLOT_* preferences.
+    """
+    return Target(
+        TARGET_URL,
+        {"first_name": FIRST_NAME, "last_name": LAST_NAME, "email": EMAIL, "phone": PHONE, "student_id": STUDENT_ID},
+        extra_fields=parse_extra_fields(EXTRA_FIELDS),
+        time_windows=SLOT_TIME_WINDOWS,
+        weekdays=SLOT_WEEKDAYS,
+    )
+
+def load_targets(path):
+    """
+    Reads a targets file: a JSON list of entries (or {"targets": [...]}).
+    Each entry needs a "url" and may set "name", "person", "fields",
+    "extra_fields", "slot_time_windows" and "slot_weekdays"; anything left
+    out comes from the environment, as for a single run.
+    """
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    entries = data.get("targets", []) if isinstance(data, dict) else data
+    base = default_target()
+    targets = []
+    names = set()
+    for i, entry in enumerate(entries):
+        name = entry.get("name") or entry["url"]
+        if name in names:
+            name = f"{name} #{i + 1}"
+        names.add(name)
+        try:
+            targets.append(Target(
+                entry["url"],
+                {**base.fields, **entry.get("fields", {})},
+                name=name,
+                person=entry.get("person"),
+                extra_fields=entry.get("extra_fields", base.extra_fields),
+                time_windows=entry.get("slot_time_windows", SLOT_TIME_WINDOWS),
+                weekdays=entry.get("slot_weekdays", SLOT_WEEKDAYS),
+            ))
+        except ValueError as e:
+            raise ValueError(f"target '{name}': {e}") from None
+    return targets
+
+RESOURCE_SIZES_PATH = os.path.join(CACHE_DIR, "resource_sizes.json")
+
+# Empty bodies for stubbed resource types
+STUB_CONTENT_TYPES = {
+    "stylesheet": "text/css",
+    "script": "application/javascript",
+    "image": "image/gif",
+    "font": "font/woff2",
+}
+
+class ResourcePolicy:
+    """
+    Route handler that blocks or stubs resources the booking flow doesn't need
+    and counts what was saved. Byte savings are estimated from the sizes seen
+    the last time each URL was actually loaded (kept in RESOURCE_SIZES_PATH).
+    Since blocked URLs never load on their own, a BLOCK_SAMPLE_RATE share of
+    the skipped passive requests (SAMPLE_RESOURCE_TYPES) with no known size
+    is fetched once outside the page to measure it; the page still sees it
+    blocked or stubbed.
+    """
+
+    def __init__(self, target_url):
+        self.mode = BLOCK_MODE
+        self.block_types = set(split_list(BLOCK_RESOURCE_TYPES))
+        self.stub_types = set(split_list(STUB_RESOURCE_TYPES))
+        self.block_patterns = [re.compile(p) for p in split_list(BLOCK_URL_PATTERNS)]
+        allow = split_list(ALLOW_URL_PATTERNS) or [re.escape(urlparse(target_url).netloc)]
+        self.allow_patterns = [re.compile(p) for p in allow]
+
+        self.sizes = load_json(RESOURCE_SIZES_PATH, {})
+        self.loaded = 0
+        self.loaded_bytes = 0
+        self.blocked = {}
+        self.stubbed = {}
+        self.saved_bytes = 0
+        self.unknown_size = 0
+        self.sampled = 0
+        self._stubbed_requests = set()
+        self._measuring = []
+        self._api = None
+
+    async def install(self, page):
+        if self.mode == "off":
+            return
+        # Shares the context's cookies, but nothing it fetches reaches the page
+        self._api = page.context.request
+        await page.route("**/*", self._handle)
+        page.on("response", self._on_response)
+
+    def _decide(self, request):
+        url = request.url
+        resource_type = request.resource_type
+        # Never interfere with the page itself
+        if resource_type == "document" and request.is_navigation_request():
+            return "allow"
+        if self.mode == "allowlist":
+            if not any(p.search(url) for p in self.allow_patterns):
+                return "stub" if resource_type in self.stub_types else "block"
+            return "allow"
+        if resource_type in self.stub_types:
+            return "stub"
+        if resource_type in self.block_types or any(p.search(url) for p in self.block_patterns):
+            return "block"
+        return "allow"
+
+    async def _handle(self, route):
+        request = route.request
+        decision = self._decide(request)
+        if decision == "allow":
+            await route.continue_()
+            return
+
+        size = self.sizes.get(request.url.split("?")[0])
+        if size is None and request.resource_type in SAMPLE_RESOURCE_TYPES and random.random() < BLOCK_SAMPLE_RATE:
+            # Scripts, XHR and beacons are never sampled: that would change what the page does
+            self.sampled += 1
+            self._measuring.append(asyncio.ensure_future(self._sample(request.url)))
+
+        counter = self.stubbed if decision == "stub" else self.blocked
+        counter[request.resource_type] = counter.get(request.resource_type, 0) + 1
+        if size is None:
+            self.unknown_size += 1
+        else:
+            self.saved_bytes += size
+
+        if decision == "stub":
+            self._stubbed_requests.add(request)
+            await route.fulfill(status=200, body="", content_type=STUB_CONTENT_TYPES.get(request.resource_type, "text/plain"))
+        else:
+            await route.abort()
+
+    def _on_response(self, response):
+        if response.request in self._stubbed_requests:
+            # Our own empty answer, not a load
+            self._stubbed_requests.discard(response.request)
+            return
+        self.loaded += 1
+        length = response.headers.get("content-length")
+        if length and length.isdigit():
+            self.loaded_bytes += int(length)
+            self.sizes[response.url.split("?")[0]] = int(length)
+
+    async def _sample(self, url):
+        try:
+            response = await self._api.get(url)
+            length = response.headers.get("content-length")
+            # Compressed or chunked responses have no content-length; count the body
+            size = int(length) if length and length.isdigit() else len(await response.body())
+            ok = response.ok
+            await response.dispose()
+        except Exception:
+            return
+        if ok:
+            self.sizes[url.split("?")[0]] = size
+
+    async def report(self):
+        if self.mode == "off":
+            return
+        if self._measuring:
+            await asyncio.wait(self._measuring, timeout=2)
+        skipped = sum(self.blocked.values()) + sum(self.stubbed.values())
+        print(f"Resource policy ({self.mode}): loaded {self.loaded} requests ({self.loaded_bytes / 1024:.0f} KB), "
+              f"skipped {skipped} (blocked {self.blocked}, stubbed {self.stubbed}), "
+              f"~{self.saved_bytes / 1024:.0f} KB saved, {self.unknown_size} of unknown size, "
+              f"{self.sampled} fetched separately to measure")
+        # Other runs may have saved sizes since this one loaded the table
+        self.sizes = {**load_json(RESOURCE_SIZES_PATH, {}), **self.sizes}
+        # Keep the size table bounded; the newest entries are at the end
+        if len(self.sizes) > 2000:
+            self.sizes = dict(list(self.sizes.items())[-2000:])
+        try:
+            save_json(RESOURCE_SIZES_PATH, self.sizes)
+        except OSError:
+            pass
+
+DEFAULT_PHASE_BUDGETS_MS = {
+    "navigate": 30000,
+    "ready": 60000,
+    "scan": 15000,
+    "open_slot": 10000,
+    "fill": 10000,
+    "submit": 10000,
+    "confirm": 30000,
+    "settle": 5000,
+}
+
+def parse_phase_budgets(value):
+    budgets = dict(DEFAULT_PHASE_BUDGETS_MS)
+    for item in split_list(value):
+        name, _, ms = item.partition("=")
+        if ms.strip().isdigit():
+            budgets[name.strip()] = int(ms)
+    return budgets
+
+class PhaseTimer:
+    """
+    Records a timed span for each sequential phase of a run, plus free-form
+    facts about the run (which dialog and submit strategy won, etc.).
+    begin() closes the current span and opens the next one.
+
+    Each phase has a budget inside the overall run deadline; remaining_ms()
+    is what a wait in the current phase may still use. When a page is
+    attached, its default Playwright timeout follows the phase budget.
+    """
+
+    def __init__(self, budgets=None, deadline_ms=None):
+        self.started_at = time.perf_counter()
+        self.budgets = parse_phase_budgets(PHASE_BUDGETS_MS) if budgets is None else budgets
+        self.deadline_ms = RUN_DEADLINE_MS if deadline_ms is None else deadline_ms
+        self.page = None
+        self.metrics = None
+        self.durations = {}
+        self.spans = []
+        self.info = {}
+        self._current = None
+        self._started = None
+
+    def begin(self, name):
+        self.end()
+        self._current = name
+        self._started = time.perf_counter()
+        if self.page is not None:
+            self.page.set_default_timeout(self.remaining_ms())
+
+    @property
+    def current(self):
+        return self._current
+
+    def end(self):
+        if self._current is not None:
+            now = time.perf_counter()
+            elapsed_ms = (now - self._started) * 1000
+            self.durations[self._current] = self.durations.get(self._current, 0) + elapsed_ms
+            self.spans.append({
+                "name": self._current,
+                "start_ms": round((self._started - self.started_at) * 1000, 1),
+                "duration_ms": round(elapsed_ms, 1),
+            })
+            self._current = None
+
+    def remaining_ms(self, cap_ms=None):
+        """
+        Time left for the current phase, bounded by the run deadline
+        (and cap_ms if given). Never 0, which Playwright reads as "no timeout".
+        """
+        now = time.perf_counter()
+        remaining = self.deadline_ms - (now - self.started_at) * 1000
+        if self._current is not None and self._current in self.budgets:
+            remaining = min(remaining, self.budgets[self._current] - (now - self._started) * 1000)
+        if cap_ms is not None:
+            remaining = min(remaining, cap_ms)
+        return max(1, int(remaining))
+
+    def total_ms(self):
+        return (time.perf_counter() - self.started_at) * 1000
+
+    def summary(self):
+        return ", ".join(f"{name} {ms / 1000:.2f}s" for name, ms in self.durations.items())
+
+    def budget_usage(self):
+        return {
+            name: round(100 * ms / self.budgets[name], 1)
+            for name, ms in self.durations.items() if self.budgets.get(name)
+        }
+
+    def budget_summary(self):
+        parts = []
+        for name, ms in self.durations.items():
+            budget = self.budgets.get(name)
+            if budget:
+                parts.append(f"{name} {ms / 1000:.2f}/{budget / 1000:.0f}s ({100 * ms / budget:.0f}%)")
+        return ", ".join(parts) + f"; run {self.total_ms() / 1000:.2f}/{self.deadline_ms / 1000:.0f}s"
+
+class RequestCounter:
+    """
+    Counts the browser requests a page makes, by resource type.
+    """
+
+    def __init__(self, page):
+        self.total = 0
+        self.failed = 0
+        self.by_type = {}
+        page.on("request", self._on_request)
+        page.on("requestfailed", self._on_failed)
+
+    def _on_request(self, request):
+        self.total += 1
+        self.by_type[request.resource_type] = self.by_type.get(request.resource_type, 0) + 1
+
+    def _on_failed(self, request):
+        self.failed += 1
+
+    def as_dict(self):
+        return {"total": self.total, "failed": self.failed, "by_type": self.by_type}
+
+class PageMetrics:
+    """
+    Chromium's own performance counters for one page, read over CDP:
+    JS heap, DOM nodes, layouts and style recalculations.
+    """
+
+    def __init__(self):
+        self.session = None
+
+    async def start(self, context, page):
+        try:
+            self.session = await context.new_cdp_session(page)
+            await self.session.send("Performance.enable")
+        except Exception as e:
+            print(f"CDP performance metrics unavailable: {e}")
+            self.session = None
+
+    async def read(self):
+        """
+        Returns the current counters, or {} without a CDP session.
+        """
+        if self.session is None:
+            return {}
+        try:
+            result = await self.session.send("Performance.getMetrics")
+        except Exception:
+            return {}
+        values = {m["name"]: m["value"] for m in result["metrics"]}
+        return {
+            "js_heap_used_mb": round(values.get("JSHeapUsedSize", 0) / 2**20, 1),
+            "js_heap_total_mb": round(values.get("JSHeapTotalSize", 0) / 2**20, 1),
+            "nodes": int(values.get("Nodes", 0)),
+            "documents": int(values.get("Documents", 0)),
+            "layout_count": int(values.get("LayoutCount", 0)),
+            "recalc_style_count": int(values.get("RecalcStyleCount", 0)),
+            "script_ms": round(values.get("ScriptDuration", 0) * 1000, 1),
+        }
+
+def append_run_record(record):
+    """
+    Appends one JSON line describing a finished run to RUN_LOG_PATH.
+    """
+    if not RUN_LOG_PATH:
+        return
+    try:
+        os.makedirs(os.path.dirname(RUN_LOG_PATH) or ".", exist_ok=True)
+        with open(RUN_LOG_PATH, "a") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"Could not write run record: {e}")
+
+# The submit button text is usually "Book", "Confirm", "Schedule", "จอง"
+SUBMIT_TEXT = re.compile(r"จอง|Book|Confirm|Schedule", re.IGNORECASE)
+SUBMIT_TEXT_EXACT = re.compile(r"^(จอง|Book|Confirm|Schedule)$", re.IGNORECASE)
+
+# True once the element can be clicked (not disabled natively or via aria)
+ENABLED_JS = "el => !el.disabled && el.getAttribute('aria-disabled') !== 'true'"
+
+# True once every visible text input of the form accepts typing
+INPUTS_READY_JS = """() => {
+    const inputs = Array.from(document.querySelectorAll('input[type="text"], input:not([type]), input[type="email"], input[type="tel"]'))
+        .filter(el => el.getClientRects().length > 0);
+    return inputs.length > 0 && inputs.every(el => !el.disabled && !el.readOnly);
+}"""
+
+async def wait_until_enabled(page, locator, timer):
+    handle = await locator.element_handle(timeout=timer.remaining_ms())
+    await page.wait_for_function(ENABLED_JS, arg=handle, timeout=timer.remaining_ms())
+
+async def wait_until_gone(locator, timer, watcher=None):
+    """
+    Waits for an element to be hidden or detached within the phase budget.
+    Given the booking watcher, any booking response ends the wait as well:
+    a rejected booking leaves the dialog open. Returns False if neither
+    happened when the budget runs out.
+    """
+    gone = asyncio.ensure_future(locator.wait_for(state="hidden", timeout=timer.remaining_ms()))
+    waits = {gone}
+    if watcher is not None:
+        waits.add(asyncio.ensure_future(watcher.responded.wait()))
+    try:
+        await asyncio.wait(waits, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in waits:
+            task.cancel()
+    if watcher is not None and watcher.responded.is_set():
+        return True
+    return gone.done() and not gone.cancelled() and gone.exception() is None
+
+# Dispatches the full pointer/mouse sequence some Google buttons listen for
+POINTER_EVENTS_JS = """element => {
+    const events = ['pointerdown', 'mousedown', 'pointerup', 'mouseup', 'click'];
+    events.forEach(eventType => {
+        const event = new MouseEvent(eventType, {
+            bubbles: true,
+            cancelable: true,
+            view: window,
+            buttons: 1
+        });
+        element.dispatchEvent(event);
+    });
+}"""
+
+async def find_booking_dialog(page, timer):
+    """
+    Locates the visible booking form container, or returns None.
+    """
+    # Prioritize the specific container class seen in user's HTML usually related to the Google Calendar booking iframe/popup
+    specific_container = page.locator('div.uW2Fw-cnG4Wd')
+    if await specific_container.count() > 0 and await specific_container.first.is_visible():
+        print("Found specific booking form container (uW2Fw-cnG4Wd).")
+        timer.info["dialog"] = "uW2Fw-cnG4Wd"
+        return specific_container.first
+
+    # Fallback to standard dialog search
+    dialogs = page.locator('div[role="dialog"]')
+    count = await dialogs.count()
+    print(f"Found {count} dialogs.")
+    for i in range(count):
+        d = dialogs.nth(i)
+        if await d.is_visible():
+            print(f"Dialog {i+1} is visible. Using this context.")
+            timer.info["dialog"] = "role=dialog"
+            return d
+    return None
+
+async def first_visible(locator):
+    """
+    Returns the first visible match of a locator, checking all matches concurrently.
+    """
+    count = await locator.count()
+    if count == 0:
+        return None
+    visible = await asyncio.gather(*(locator.nth(i).is_visible() for i in range(count)))
+    for i, is_visible in enumerate(visible):
+        if is_visible:
+            return locator.nth(i)
+    return None
+
+async def first_present(locator):
+    return locator.first if await locator.count() > 0 else None
+
+# Each probe returns the element to click (or None) without touching the page;
+# each click performs the interaction that worked for that element type.
+
+async def probe_span_parent(page, dialog):
+    # Button HTML: <button ...><span class="YUhpIc-vQzf8d">จอง</span>...</button>
+    return await first_present(dialog.locator('span.YUhpIc-vQzf8d', has_text="จอง"))
+
+async def click_span_parent(page, span, timer, watcher=None):
+    print("Found 'จอง' span with specific class. Clicking parent button...")
+    parent_btn = span.locator("..")
+
+    # Ensure button is in view
+    await parent_btn.scroll_into_view_if_needed()
+
+    # Use a more human-like click sequence with pointer events
+    # Some Google buttons rely on pointerdown/up or mousedown/up
+    box = await parent_btn.bounding_box()
+    if box:
+        # Center coordinates
+        x = box['x'] + box['width'] / 2
+        y = box['y'] + box['height'] / 2
+
+        print(f"Moving mouse to coordinates ({x}, {y}) for physical click...")
+
+        # Move mouse in steps to simulate human movement (optional, but helps)
+        await page.mouse.move(x, y, steps=10)
+        await wait_until_enabled(page, parent_btn, timer)
 
-            # Wait for content to load
+        # Physical mouse down and up
+        await page.mouse.down()
+        if CLICK_HOLD_MS:
+            await page.wait_for_timeout(CLICK_HOLD_MS) # Hold click slightly
+        await page.mouse.up()
+
+        print("Executed physical mouse click.")
+    else:
+        # Fallback if box not found (e.g. hidden)
+        print("Bounding box not found. Fallback to JS dispatch.")
+        await parent_btn.evaluate(POINTER_EVENTS_JS)
+
+    # The dialog closes once the booking request goes through
+    if not await wait_until_gone(parent_btn, timer, watcher):
+        print("Button potentially still visible. Trying one last 'force' click directly on span...")
+        await span.click(force=True)
+
+async def probe_jsname(page, dialog):
+    # jsname="hNX5Yc" seems to be the submit button identifier
+    return await first_present(dialog.locator('button[jsname="hNX5Yc"]'))
+
+async def click_jsname(page, btn, timer, watcher=None):
+    print("Found button with jsname='hNX5Yc'. Clicking...")
+    await btn.scroll_into_view_if_needed()
+    await btn.hover()
+    await wait_until_enabled(page, btn, timer)
+
+    print("Dispatching pointer events on JS-named button...")
+    await btn.evaluate(POINTER_EVENTS_JS)
+
+    # Physical click backup if still visible
+    if not await wait_until_gone(btn, timer, watcher):
+        print("JS-named button still visible, trying physical click...")
+        await btn.click(force=True)
+
+async def probe_button_has_text(page, dialog):
+    return await first_present(dialog.locator('button', has_text="จอง"))
+
+async def probe_exact_text(page, dialog):
+    return await first_present(dialog.get_by_text("จอง", exact=True))
+
+async def probe_book_text(page, dialog):
+    return await first_visible(dialog.get_by_text("Book", exact=True))
+
+async def probe_dialog_role(page, dialog):
+    return await first_visible(dialog.get_by_role("button", name=SUBMIT_TEXT))
+
+async def probe_dialog_last_button(page, dialog):
+    # Usually the primary action
+    buttons = dialog.locator("button")
+    return buttons.last if await buttons.count() > 0 else None
+
+async def probe_global_role(page, dialog):
+    return await first_visible(page.get_by_role("button", name=SUBMIT_TEXT_EXACT))
+
+async def probe_global_text(page, dialog):
+    # In case the role is missing
+    return await first_visible(page.get_by_text(SUBMIT_TEXT_EXACT))
+
+async def click_force(page, btn, timer, watcher=None):
+    await btn.click(force=True)
+
+async def click_scroll_force(page, btn, timer, watcher=None):
+    await btn.scroll_into_view_if_needed()
+    await btn.click(force=True)
+
+# (name, needs the dialog, probe, click) in the original fallback order
+SUBMIT_STRATEGIES = [
+    ("span_parent", True, probe_span_parent, click_span_parent),
+    ("jsname", True, probe_jsname, click_jsname),
+    ("button_has_text", True, probe_button_has_text, click_force),
+    ("exact_text", True, probe_exact_text, click_force),
+    ("book_text", True, probe_book_text, click_force),
+    ("dialog_role", True, probe_dialog_role, click_force),
+    ("dialog_last_button", True, probe_dialog_last_button, click_force),
+    ("global_role", False, probe_global_role, click_scroll_force),
+    ("global_text", False, probe_global_text, click_scroll_force),
+]
+
+SUBMIT_CACHE_PATH = os.path.join(CACHE_DIR, "submit_strategies.json")
+
+CONFIRMATION_TEXT = re.compile(r"Booking confirmed|การจองได้รับการยืนยัน|ยืนยันการนัดหมาย|Confirmed|ยืนยันการจองแล้ว", re.IGNORECASE)
+
+def ordered_submit_strategies(url):
+    """
+    Orders the strategies for a target: the last winner first, then by
+    wins minus fails, then the original order. Strategies that have not
+    worked SUBMIT_EVICT_AFTER times in a row go to the back.
+    """
+    stats = load_json(SUBMIT_CACHE_PATH, {}).get(url, {})
+    last_winner = max(stats, key=lambda name: stats[name].get("last_win", 0), default=None)
+    if last_winner is not None and not stats[last_winner].get("last_win"):
+        last_winner = None
+
+    def key(indexed):
+        index, strategy = indexed
+        record = stats.get(strategy[0], {})
+        evicted = record.get("streak", 0) >= SUBMIT_EVICT_AFTER
+        return (evicted, strategy[0] != last_winner, record.get("fails", 0) - record.get("wins", 0), index)
+
+    return [strategy for _, strategy in sorted(enumerate(SUBMIT_STRATEGIES), key=key)]
+
+def record_submit_result(url, winner, misses, confirmed):
+    """
+    Updates the strategy cache after the confirmation step. The clicked
+    strategy wins or fails depending on the outcome; strategies that were
+    probed first and found nothing count towards their failure streak.
+    """
+    cache = load_json(SUBMIT_CACHE_PATH, {})
+    stats = cache.setdefault(url, {})
+    for name in misses:
+        record = stats.setdefault(name, {})
+        record["streak"] = record.get("streak", 0) + 1
+    if winner:
+        record = stats.setdefault(winner, {})
+        if confirmed:
+            record["wins"] = record.get("wins", 0) + 1
+            record["streak"] = 0
+            record["last_win"] = time.time()
+        else:
+            record["fails"] = record.get("fails", 0) + 1
+            record["streak"] = record.get("streak", 0) + 1
+    try:
+        save_json(SUBMIT_CACHE_PATH, cache)
+    except OSError as e:
+        print(f"Could not save submit strategy cache: {e}")
+
+async def click_submit(page, dialog, timer, url, watcher=None):
+    """
+    Finds and clicks the submit button. The strategy that won last time
+    for this target is tried on its own first; if it finds nothing, the
+    remaining strategies are probed concurrently and the best-ranked one
+    that found a button is clicked. Given the booking watcher, a click
+    gives up on its fallback once a booking response has arrived.
+    """
+    strategies = [s for s in ordered_submit_strategies(url) if dialog is not None or not s[1]]
+    misses = []
+    timer.info["submit_misses"] = misses
+
+    async def probe(strategy):
+        try:
+            return await strategy[2](page, dialog)
+        except Exception as e:
+            print(f"Submit strategy {strategy[0]} probe failed: {e}")
+            return None
+
+    async def click(strategy, target):
+        print(f"Using submit strategy: {strategy[0]}")
+        # Submit-to-answer latency is measured from the first click
+        timer.info.setdefault("submit_clicked_at", time.perf_counter())
+        await strategy[3](page, target, timer, watcher)
+        timer.info["submit_strategy"] = strategy[0]
+        return True
+
+    if not strategies:
+        return False
+
+    # Fast path: the cached favourite alone
+    first = strategies[0]
+    target = await probe(first)
+    if target is not None:
+        return await click(first, target)
+    misses.append(first[0])
+
+    rest = strategies[1:]
+    targets = await asyncio.gather(*(probe(strategy) for strategy in rest))
+    for strategy, target in zip(rest, targets):
+        if target is not None:
+            return await click(strategy, target)
+    return False
+
+FORM_CACHE_PATH = os.path.join(CACHE_DIR, "form_fields.json")
+
+def form_fields(target):
+    """
+    Returns (name, label regex, value) for every field the target's form should get.
+    """
+    # Use regex to support both Thai and English labels
+    fields = [
+        ("first_name", r"ชื่อ|First name", target.fields.get("first_name")),
+        ("last_name", r"นามสกุล|Last name", target.fields.get("last_name")),
+        ("email", r"อีเมล|Email address", target.fields.get("email")),
+        # Google Calendar sometimes asks for "Phone number" or "หมายเลขโทรศัพท์"
+        ("phone", r"หมายเลขโทรศัพท์|Phone number", target.fields.get("phone")),
+        # Custom field - might be tricky if label text is slightly different
+        ("student_id", r"รหัสนิสิต|Student ID", target.fields.get("student_id")),
+    ]
+    for i, (pattern, value) in enumerate(target.extra_fields.items()):
+        fields.append((f"extra_{i + 1}", pattern, str(value)))
+    return fields
+
+# Runs inside the page in a single round trip. The form's structure
+# signature (visible inputs with their type/name/aria-label/placeholder, in
+# order) is compared with the cached one; on a match the cached field
+# positions are used directly, otherwise every field's label regex is
+# resolved against the inputs' accessible labels (aria-labelledby,
+# aria-label, <label>) as get_by_label would. Resolved inputs are tagged
+# with data-bot-field. With fill=true the values are set through the native
+# value setter plus input/change events, and any that didn't stick are reported.
+FORM_FILL_JS = """({fields, cached, fill}) => {
+    const inputs = Array.from(document.querySelectorAll(
+        'input:not([type=hidden]):not([type=checkbox]):not([type=radio]):not([type=submit]):not([type=button]), textarea'
+    )).filter(el => el.getClientRects().length > 0);
+
+    const signature = JSON.stringify(inputs.map(el => [
+        el.tagName, el.type || '', el.name || '', el.getAttribute('aria-label') || '', el.placeholder || '',
+    ]));
+
+    let assign = null;
+    let resolved = false;
+    if (cached && cached.signature === signature) {
+        assign = cached.assign;
+    } else {
+        resolved = true;
+        assign = {};
+        const labelOf = el => {
+            const parts = [];
+            const labelledBy = el.getAttribute('aria-labelledby');
+            if (labelledBy) {
+                labelledBy.split(/\\s+/).forEach(id => {
+                    const ref = document.getElementById(id);
+                    if (ref) parts.push(ref.textContent);
+                });
+            }
+            if (el.getAttribute('aria-label')) parts.push(el.getAttribute('aria-label'));
+            if (el.labels) Array.from(el.labels).forEach(label => parts.push(label.textContent));
+            return parts.join(' ').replace(/\\s+/g, ' ').trim();
+        };
+        const labels = inputs.map(labelOf);
+        const taken = new Set();
+        fields.forEach(field => {
+            const pattern = new RegExp(field.pattern, 'i');
+            const index = labels.findIndex((label, i) => !taken.has(i) && pattern.test(label));
+            if (index >= 0) {
+                taken.add(index);
+                assign[field.name] = index;
+            }
+        });
+    }
+
+    fields.forEach(field => {
+        const el = inputs[assign[field.name]];
+        if (!el) return;
+        el.setAttribute('data-bot-field', field.name);
+        if (!fill) return;
+        const setter = Object.getOwnPropertyDescriptor(Object.getPrototypeOf(el), 'value').set;
+        el.focus();
+        setter.call(el, field.value);
+        el.dispatchEvent(new Event('input', {bubbles: true}));
+        el.dispatchEvent(new Event('change', {bubbles: true}));
+    });
+    if (fill && document.activeElement) document.activeElement.blur();
+
+    return {signature, assign, resolved};
+}"""
+
+# Reads the filled values back once the page has reacted to the input events:
+# a framework-controlled input may reject or reset the value after the event,
+# which a check in the same task as the setter can't see. Waits a frame, or
+# 100 ms if frames are paused (hidden page).
+FORM_CHECK_JS = """fields => new Promise(resolve => {
+    const check = () => resolve(fields.filter(field => {
+        const el = document.querySelector(`[data-bot-field="${field.name}"]`);
+        return el && el.value !== field.value;
+    }).map(field => field.name));
+    requestAnimationFrame(() => setTimeout(check, 0));
+    setTimeout(check, 100);
+})"""
+
+async def fill_form(page, fields, timer, url):
+    """
+    Resolves and fills all form fields in one in-page pass. The resolved
+    label-to-field map is cached per target in FORM_CACHE_PATH so later
+    runs skip label discovery unless the form structure changes. Fields
+    that can't be resolved or didn't take the value fall back to
+    get_by_label().fill().
+    """
+    cached = load_json(FORM_CACHE_PATH, {}).get(url)
+    names = [name for name, _, _ in fields]
+    # A different set of configured fields needs a fresh label scan
+    if cached and cached.get("fields") != names:
+        cached = None
+    batch = FORM_FILL_MODE == "batch"
+
+    result = await page.evaluate(FORM_FILL_JS, {
+        "fields": [{"name": name, "pattern": pattern, "value": value} for name, pattern, value in fields],
+        "cached": cached,
+        "fill": batch,
+    })
+    timer.info["form_map"] = "resolved" if result["resolved"] else "cached"
+    print(f"Form field map {timer.info['form_map']} ({len(result['assign'])}/{len(fields)} fields).")
+
+    if result["resolved"]:
+        # Re-read, since other targets may have saved theirs during the evaluation
+        cache = load_json(FORM_CACHE_PATH, {})
+        cache[url] = {"fields": names, "signature": result["signature"], "assign": result["assign"]}
+        try:
+            save_json(FORM_CACHE_PATH, cache)
+        except OSError as e:
+            print(f"Could not save form field cache: {e}")
+
+    mismatched = []
+    if batch:
+        mismatched = await page.evaluate(FORM_CHECK_JS, [
+            {"name": name, "value": value} for name, _, value in fields if name in result["assign"]
+        ])
+        if mismatched:
+            print(f"Fields {', '.join(mismatched)} didn't keep the value. Filling them with Playwright...")
+
+    for name, pattern, value in fields:
+        if name not in result["assign"]:
+            print(f"Field '{name}' not found by label scan. Falling back to get_by_label...")
+            await page.get_by_label(re.compile(pattern, re.IGNORECASE)).fill(value)
+        elif not batch or name in mismatched:
+            await page.locator(f'[data-bot-field="{name}"]').fill(value)
+
+class BookingResponseWatcher:
+    """
+    Listens for the booking request's response (CONFIRM_URL_PATTERN) and
+    classifies it as soon as it arrives: an error status or a body matching
+    CONFIRM_ERROR_PATTERN is "rejected", a 2xx whose body matches
+    CONFIRM_SUCCESS_PATTERN is "confirmed". Anything else is ambiguous and
+    left to the confirmation text. Install it before the submit click so no
+    response is missed.
+    """
+
+    def __init__(self, page):
+        self.page = page
+        self.url_pattern = re.compile(CONFIRM_URL_PATTERN, re.IGNORECASE)
+        self.error_pattern = re.compile(CONFIRM_ERROR_PATTERN, re.IGNORECASE)
+        self.success_pattern = re.compile(CONFIRM_SUCCESS_PATTERN, re.IGNORECASE)
+        self.ambiguous = []
+        self.result = asyncio.get_running_loop().create_future()
+        # Set by any booking response, classified or not
+        self.responded = asyncio.Event()
+        self.detail = {}
+        self._listening = True
+        page.on("response", self._on_response)
+
+    def _on_response(self, response):
+        if response.request.method not in ("POST", "PUT") or not self.url_pattern.search(response.url):
+            return
+        self.responded.set()
+        if not self.result.done():
+            asyncio.ensure_future(self._classify(response))
+
+    async def _classify(self, response):
+        try:
+            body = await response.text()
+        except Exception:
+            body = ""
+        if response.status >= 400 or self.error_pattern.search(body):
+            verdict = "rejected"
+        elif 200 <= response.status < 300 and self.success_pattern.search(body):
+            verdict = "confirmed"
+        else:
+            # No positive marker: don't guess, keep listening and let the text signal decide
+            self.ambiguous.append({"url": response.url, "status": response.status})
+            return
+        if not self.result.done():
+            self.detail = {"url": response.url, "status": response.status, "body": body[:200]}
+            self.result.set_result(verdict)
+
+    def stop(self):
+        if self._listening:
+            self._listening = False
+            self.page.remove_listener("response", self._on_response)
+
+async def wait_for_confirmation(page, watcher, timer):
+    """
+    Races the booking response against the confirmation text within the
+    confirm budget. Returns (outcome, source) where outcome is "confirmed",
+    "rejected" or "unconfirmed" and source is "network", "text" or None.
+    """
+    # "การจองได้รับการยืนยัน" or "Booking confirmed"; the text locator stays as a secondary signal
+    success_msg = page.get_by_text(CONFIRMATION_TEXT)
+    text_task = asyncio.ensure_future(success_msg.first.wait_for(state="visible", timeout=timer.remaining_ms()))
+    network_task = asyncio.ensure_future(asyncio.shield(watcher.result))
+    pending = {text_task, network_task}
+    outcome, source = "unconfirmed", None
+    deadline = time.perf_counter() + timer.remaining_ms() / 1000
+
+    try:
+        while pending and outcome == "unconfirmed":
+            done, pending = await asyncio.wait(pending, timeout=max(0, deadline - time.perf_counter()), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                if task.exception() is not None:
+                    continue
+                if task is network_task:
+                    outcome, source = task.result(), "network"
+                else:
+                    outcome, source = "confirmed", "text"
+                break
+    finally:
+        # The watcher keeps listening, so a retried confirm step still sees the response
+        for task in pending:
+            task.cancel()
+
+    answered_at = time.perf_counter()
+    clicked_at = timer.info.get("submit_clicked_at")
+    timer.info["confirmation"] = {
+        "outcome": outcome,
+        "source": source,
+        "latency_ms": round((answered_at - clicked_at) * 1000, 1) if clicked_at and source else None,
+        **({k: watcher.detail[k] for k in ("url", "status")} if source == "network" else {}),
+        "ambiguous_responses": watcher.ambiguous,
+    }
+    return outcome, source
+
+# Add arguments to make the browser look more like a real user and less like a bot
+DEFAULT_LAUNCH_ARGS = [
+    '--disable-blink-features=AutomationControlled',
+    '--disable-features=IsolateOrigins,site-per-process', # Helps with iframes sometimes
+    '--use-fake-ui-for-media-stream',
+    '--no-sandbox',
+    '--disable-setuid-sandbox',
+]
+
+def parse_viewport(value):
+    width, _, height = value.lower().partition("x")
+    return {"width": int(width), "height": int(height)}
+
+async def launch_browser(p, args=None):
+    """
+    Starts headless Chromium with the stealth launch arguments
+    (LAUNCH_ARGS or DEFAULT_LAUNCH_ARGS unless `args` is given).
+    """
+    if args is None:
+        args = LAUNCH_ARGS.split() or DEFAULT_LAUNCH_ARGS
+    return await p.chromium.launch(
+        headless=True,
+        executable_path=CHROMIUM_EXECUTABLE_PATH or None,
+        args=args,
+    )
+
+async def new_booking_context(browser, viewport=None, device_scale_factor=None):
+    """
+    Creates a browser context with a realistic user agent and viewport
+    (VIEWPORT and DEVICE_SCALE_FACTOR unless given).
+    """
+    # Set locale to Thai to match user's screenshot and expectations
+    context = await browser.new_context(
+        locale='th-TH',
+        user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        viewport=viewport or parse_viewport(VIEWPORT),
+        device_scale_factor=device_scale_factor or DEVICE_SCALE_FACTOR,
+    )
+
+    # Hide the webdriver property
+    await context.add_init_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
+    return context
+
+CHECKPOINT_PATH = os.path.join(CACHE_DIR, "checkpoints.json")
+
+BOOKING_STEPS = ["navigate", "scan", "open_slot", "fill", "submit", "confirm"]
+
+FORM_INPUT_SELECTOR = 'input[type="text"]'
+
+class BookingFlow:
+    """
+    The booking flow split into explicit steps (BOOKING_STEPS), one method
+    each. Every completed step is checkpointed. A failed step is retried
+    after a jittered backoff, resuming from the latest step that is still
+    safe to repeat in the same page instead of restarting the run. The
+    submit click is never repeated: once it has happened, a failure can
+    only resume at "confirm".
+    """
+
+    def __init__(self, page, timer, watcher, artifacts, target, limiter=None):
+        self.page = page
+        self.timer = timer
+        self.watcher = watcher
+        self.artifacts = artifacts
+        self.target = target
+        self.limiter = limiter
+        self.completed = None
+        self.history = []
+        self.slot = None
+        self.booking_watcher = None
+        self.outcome = None
+
+    async def navigate(self):
+        if self.limiter is not None:
+            self.timer.begin("rate_limit")
+            await self.limiter.wait(self.target.url)
+        self.timer.begin("navigate")
+        print(f"Navigating to {self.target.url}...")
+        if self.watcher is not None:
+            self.watcher.start()
+            # The observer takes over from here, so don't block on the load event
+            await self.page.goto(self.target.url, wait_until="domcontentloaded")
+        else:
+            await self.page.goto(self.target.url)
+
+        self.timer.begin("ready")
+        await wait_for_slots_ready(self.page, self.watcher, self.timer, self.artifacts)
+        if self.watcher is not None:
+            self.timer.info["ready"] = self.watcher.reason
+            first_slot_ms = self.watcher.time_to_first_slot_ms()
+            self.timer.info["time_to_first_slot_ms"] = round(first_slot_ms, 1) if first_slot_ms is not None else None
+
+    async def scan(self):
+        timer = self.timer
+        timer.begin("scan")
+        print("Scanning for slots...")
+
+        if SLOT_SCAN_COMPARE:
+            await compare_slot_scans(self.page)
+
+        # Parse every week into structured slot records and compare with the last poll
+        records, page_week = await scan_weeks(self.page, timer)
+        index = load_json(SLOT_INDEX_PATH, {})
+        diff = diff_slot_index(index.get(self.target.url, {}).get("slots"), records)
+        index[self.target.url] = {
+            "updated": datetime.now().isoformat(timespec="seconds"),
+            "slots": {r["key"]: {k: v for k, v in r.items() if k != "handle"} for r in records},
+        }
+        try:
+            save_json(SLOT_INDEX_PATH, index)
+        except OSError as e:
+            print(f"Could not save slot index: {e}")
+        timer.info["slots"] = {"total": len(records), "enabled": sum(r["enabled"] for r in records), **{k: len(v) for k, v in diff.items()}}
+        print(f"Slot index: {len(records)} slots over {page_week + 1} week(s), "
+              f"{len(diff['new'])} new, {len(diff['removed'])} removed, {len(diff['newly_enabled'])} newly enabled.")
+
+        self.slot = None
+        choice = choose_slot(records, diff, self.target)
+        if choice:
+            print(f"Slot is available! Selecting: {choice['text']} ({choice['date'] or 'unknown date'} {choice['time']})")
+            timer.info["selected_slot"] = choice["key"]
+            self.slot = await locate_indexed_slot(self.page, choice, page_week, timer)
+
+        if not self.slot:
+            self.artifacts.screenshot("no_slots_found")
+            print("No active slots found.")
+            self.outcome = "no_slots"
+
+    async def open_slot(self):
+        self.timer.begin("open_slot")
+        if await self.form_visible():
+            # Resumed after the slot was already opened
+            print("Booking form is already open.")
+        else:
+            print("Clicking the available slot...")
+            await self.slot.click()
+
+        # Wait for the booking form dialog/page
+        print("Waiting for booking form...")
+        await self.page.wait_for_selector(FORM_INPUT_SELECTOR, state="visible", timeout=self.timer.remaining_ms())
+        # Make sure all inputs are interactive before typing
+        await self.page.wait_for_function(INPUTS_READY_JS, timeout=self.timer.remaining_ms())
+
+    async def fill(self):
+        self.timer.begin("fill")
+        print("Filling form...")
+        await fill_form(self.page, form_fields(self.target), self.timer, self.target.url)
+
+    async def submit(self):
+        self.timer.begin("submit")
+        print("Form filled. Submitting...")
+
+        # Listen for the booking request before anything is clicked
+        if self.booking_watcher is not None:
+            self.booking_watcher.stop()
+        self.booking_watcher = BookingResponseWatcher(self.page)
+
+        visible_dialog = await find_booking_dialog(self.page, self.timer)
+        if visible_dialog is None:
+            print("No dialog found! Attempting global search...")
+
+        clicked = await click_submit(self.page, visible_dialog, self.timer, self.target.url, self.booking_watcher)
+        if not clicked:
+            # Often just not rendered yet; failing lets the step be retried while the form is open
+            raise RuntimeError("No submit button found.")
+
+    async def confirm(self):
+        # Wait for confirmation screen
+        self.timer.begin("confirm")
+        print("Waiting for confirmation...")
+
+        # Whichever comes first: the booking response or the confirmation text
+        outcome, source = await wait_for_confirmation(self.page, self.booking_watcher, self.timer)
+        latency_ms = self.timer.info["confirmation"]["latency_ms"]
+        after_submit = f"{latency_ms:.0f} ms after submit" if latency_ms is not None else "without a submit click"
+        detail = self.booking_watcher.detail
+        if outcome == "confirmed":
+            print(f"✅ Success! Booking confirmed by {source} signal {after_submit}.")
+        elif outcome == "rejected":
+            print(f"❌ Booking rejected by the server (HTTP {detail.get('status')}) {after_submit}: {detail.get('body')}")
+        else:
+            print("⚠️ Warning: No booking response or 'Booking confirmed' text within the confirm budget.")
+        if outcome != "confirmed":
+            # Capture HTML for debugging
+            self.artifacts.page_source("page_source")
+
+        # Learn which submit strategy worked for this target
+        record_submit_result(self.target.url, self.timer.info.get("submit_strategy"), self.timer.info.get("submit_misses", []), outcome == "confirmed")
+        self.outcome = outcome
+
+    async def settle(self):
+        # Let in-flight backend requests (email sending trigger) finish, within the settle budget
+        self.timer.begin("settle")
+        print("Waiting for outstanding requests to settle...")
+        try:
+            await self.page.wait_for_load_state("networkidle", timeout=self.timer.remaining_ms())
+        except:
+            print("Network still busy at the end of the settle budget.")
+
+        # Screenshot confirmation
+        self.artifacts.screenshot("confirmation", failure=self.outcome != "confirmed")
+        print("ℹ️ Please check your email (including Spam/Junk folder) for the confirmation.")
+
+    async def form_visible(self):
+        try:
+            return await self.page.locator(FORM_INPUT_SELECTOR).first.is_visible()
+        except Exception:
+            return False
+
+    async def resume_point(self, step, failures):
+        """
+        The step to pick the flow up from after `step` failed for the
+        `failures`-th time.
+        """
+        if self.timer.info.get("submit_clicked_at") is not None:
+            # The booking may already be on its way; only look for the answer again
+            return "confirm"
+        if step in ("navigate", "confirm"):
+            return step
+        if step == "scan":
+            # Scanning twice in a broken page won't help, so load it again
+            return self.rescan_point() if failures == 1 else "navigate"
+        if await self.form_visible():
+            # The form is still open: redo the failed step, re-filling before another submit
+            return "fill" if step == "submit" else step
+        # The form is gone, so check the slot is still free before opening it again
+        return self.rescan_point()
+
+    def rescan_point(self):
+        # scan_weeks() starts from the first week; after walking weeks the page may be elsewhere
+        return "navigate" if SLOT_INDEX_WEEKS > 1 else "scan"
+
+    def checkpoint(self, step):
+        self.completed = step
+        self.history.append({"step": step, "ok": True, "at_ms": round(self.timer.total_ms(), 1)})
+        checkpoints = load_json(CHECKPOINT_PATH, {})
+        checkpoints[self.target.url] = {
+            "updated": datetime.now().isoformat(timespec="seconds"),
+            "step": step,
+            "slot": self.timer.info.get("selected_slot"),
+            "submitted": self.timer.info.get("submit_clicked_at") is not None,
+            "outcome": self.outcome,
+        }
+        try:
+            save_json(CHECKPOINT_PATH, checkpoints)
+        except OSError as e:
+            print(f"Could not save checkpoint: {e}")
+
+    async def run(self):
+        """
+        Runs the steps in order and returns the outcome. Raises the last
+        error once a step has failed more than STEP_RETRIES times or the
+        backoff would not fit in the run deadline.
+        """
+        previous = load_json(CHECKPOINT_PATH, {}).get(self.target.url)
+        if previous and previous.get("submitted") and previous.get("outcome") is None:
+            print(f"Note: the run at {previous['updated']} clicked submit for {previous.get('slot')} but ended without an answer. "
+                  "Check your email before relying on a new booking.")
+
+        try:
+            return await self._run_steps()
+        finally:
+            if self.booking_watcher is not None:
+                self.booking_watcher.stop()
+
+    async def _run_steps(self):
+        failures = {}
+        step = BOOKING_STEPS[0]
+        while step is not None:
             try:
-                # Wait for any button to load which indicates interactivity
-                await page.wait_for_selector('div[role="button"], button', timeout=60000)
-            except:
-                print("Timeout waiting for page content.")
-                await page.screenshot(path=get_screenshot_path("page_load_timeout"))
+                await getattr(self, step)()
+            except Exception as e:
+                failures[step] = failures.get(step, 0) + 1
+                error = str(e).splitlines()[0] if str(e) else type(e).__name__
+                self.history.append({"step": step, "ok": False, "at_ms": round(self.timer.total_ms(), 1), "error": error[:200]})
+                if failures[step] > STEP_RETRIES:
+                    raise
+                resume = await self.resume_point(step, failures[step])
+                delay_ms = STEP_BACKOFF_MS * 2 ** (failures[step] - 1) * random.uniform(0.5, 1.5)
+                if delay_ms >= self.timer.deadline_ms - self.timer.total_ms():
+                    raise
+                print(f"Step '{step}' failed: {error}. Retry {failures[step]}/{STEP_RETRIES} from '{resume}' in {delay_ms:.0f} ms.")
+                self.timer.begin("retry")
+                await asyncio.sleep(delay_ms / 1000)
+                step = resume
+                continue
+
+            self.checkpoint(step)
+            if self.outcome == "no_slots":
+                break
+            index = BOOKING_STEPS.index(step) + 1
+            step = BOOKING_STEPS[index] if index < len(BOOKING_STEPS) else None
 
-            # Wait for network idle to ensure slots are loaded
+        if self.outcome not in (None, "no_slots"):
+            await self.settle()
+        return self.outcome or "error"
+
+async def run_booking(context, timer=None, target=None, limiter=None, metrics=False):
+    """
+    Runs one pass of the booking flow for `target` (default_target() if
+    not given) in a fresh page of the given context. Returns the outcome:
+    "no_slots", "confirmed", "rejected", "unconfirmed", "error" or
+    "cancelled". Phase durations are recorded on `timer` when one is
+    passed in; with `metrics`, so are the page's CDP performance metrics.
+    """
+    timer = timer or PhaseTimer()
+    # Only several targets share results/ at once; a single run keeps the plain names
+    tag = slugify(target.name) if target else None
+    target = target or default_target()
+    page = await context.new_page()
+    timer.page = page
+    artifacts = ArtifactWriter(page, tag)
+
+    page_metrics = None
+    if metrics:
+        page_metrics = PageMetrics()
+        await page_metrics.start(context, page)
+        timer.metrics = page_metrics
+
+    resources = ResourcePolicy(target.url)
+    await resources.install(page)
+    requests = RequestCounter(page)
+
+    tracing = False
+    if TRACE_SLOW_RUNS_MS > 0:
+        try:
+            await context.tracing.start(screenshots=True, snapshots=True)
+            tracing = True
+        except Exception as e:
+            print(f"Could not start tracing: {e}")
+
+    watcher = None
+    if READY_MODE == "slot":
+        watcher = SlotWatcher()
+        await watcher.install(page)
+
+    flow = BookingFlow(page, timer, watcher, artifacts, target, limiter)
+    outcome = "error"
+    try:
+        outcome = await flow.run()
+    except asyncio.CancelledError:
+        print(f"Run for {target.name} cancelled.")
+        outcome = "cancelled"
+        raise
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        outcome = "error"
+        artifacts.screenshot("error", failure=True)
+        artifacts.page_source("error_page_source")
+    finally:
+        timer.end()
+        total_ms = timer.total_ms()
+        print(f"Phase timings: {timer.summary()}")
+        print(f"Budget use: {timer.budget_summary()}")
+        await resources.report()
+
+        artifact_paths = await artifacts.drain()
+        if page_metrics is not None:
+            timer.info["page_metrics"] = await page_metrics.read()
+
+        trace_path = None
+        if tracing:
             try:
-                await page.wait_for_load_state('networkidle')
-            except:
-                pass
-
-            print("Scanning for slots...")
-            
-            # Use a broad selector for anything clickable with time text
-            # Matches 9:00, 09:00, 9:00am, 9:00 PM etc.
-            # We look for elements that have text matching the time pattern.
-            # We don't restrict to role="button" initially to see if we can find them at all, 
-            # sometimes they are just spans inside a button.
-            
-            # Selector strategies:
-            # 1. Exact role="button" with time text (Primary)
-            # 2. Any element with class likely to be a slot (Secondary)
-            
-            # Try to find all buttons first
-            params = re.compile(r"\d{1,2}:\d{2}")
-            # Locate all elements that look like time slots
-            # We specifically look for the time text "9:00" style.
-            
-            # Strategy: Find buttons, then filter by text.
-            potential_slots = await page.locator('div[role="button"], button').all()
-            
-            available_slot = None
-            print(f"Found {len(potential_slots)} potential clickable elements. Checking for time slots...")
-
-            for slot in potential_slots:
-                if await slot.is_visible():
-                    text = await slot.inner_text()
-                    label = await slot.get_attribute("aria-label") or ""
-                    
-                    # Check if text or label contains a time pattern
-                    if params.search(text) or params.search(label):
-                         is_disabled = await slot.get_attribute("aria-disabled")
-                         is_hidden = await slot.get_attribute("aria-hidden")
-                         
-                         print(f"Found time slot candidate: '{text}' (Label: '{label}') - Disabled: {is_disabled}")
-                         
-                         if is_disabled != "true" and is_hidden != "true":
-                             print(f"Slot is available! Selecting: {text}")
-                             available_slot = slot
-                             break
-            
-            if not available_slot:
-                await page.screenshot(path=get_screenshot_path("no_slots_found"))
-                print("No active slots found. Screenshot saved.")
-            else:
-                print("Clicking the available slot...")
-                await available_slot.click()
-                
-                # Wait for the booking form dialog/page
-                print("Waiting for booking form...")
-                await page.wait_for_selector('input[type="text"]', state="visible", timeout=10000)
-                # Small delay to ensure all inputs are interactive
-                await page.wait_for_timeout(500)
-                
-                # Fill Form
-                print("Filling form...")
-                # Use regex to support both Thai and English labels
-                await page.get_by_label(re.compile(r"ชื่อ|First name", re.IGNORECASE)).fill(FIRST_NAME)
-                await page.get_by_label(re.compile(r"นามสกุล|Last name", re.IGNORECASE)).fill(LAST_NAME)
-                await page.get_by_label(re.compile(r"อีเมล|Email address", re.IGNORECASE)).fill(EMAIL)
-                # Google Calendar sometimes asks for "Phone number" or "หมายเลขโทรศัพท์"
-                # Using more robust regex matching for labels
-                await page.get_by_label(re.compile(r"หมายเลขโทรศัพท์|Phone number", re.IGNORECASE)).fill(PHONE)
-                
-                # Custom field - might be tricky if label text is slightly different
-                # We try to match "Student ID" or "รหัสนิสิต"
-                await page.get_by_label(re.compile(r"รหัสนิสิต|Student ID", re.IGNORECASE)).fill(STUDENT_ID)
-
-                print("Form filled. Submitting...")
-                
-                # Locate the visible dialog/form container
-                # Prioritize the specific container class seen in user's HTML usually related to the Google Calendar booking iframe/popup
-                visible_dialog = None
-                
-                # Try finding the specific container class from user HTML "uW2Fw-cnG4Wd"
-                specific_container = page.locator('div.uW2Fw-cnG4Wd')
-                if await specific_container.count() > 0 and await specific_container.first.is_visible():
-                     print("Found specific booking form container (uW2Fw-cnG4Wd).")
-                     visible_dialog = specific_container.first
-                else: 
-                     # Fallback to standard dialog search
-                     dialogs = page.locator('div[role="dialog"]')
-                     count = await dialogs.count()
-                     print(f"Found {count} dialogs.")
-                     for i in range(count):
-                        d = dialogs.nth(i)
-                        if await d.is_visible():
-                            visible_dialog = d
-                            print(f"Dialog {i+1} is visible. Using this context.")
-                            break
-                
-                clicked = False
-                if visible_dialog:
-                    # Search for the submit button within the visible dialog
-                    print("Searching for buttons inside the visible dialog...")
-                    # The button text is usually "Book", "Confirm", "Schedule", "จอง"
-                    pattern = re.compile(r"จอง|Book|Confirm|Schedule", re.IGNORECASE)
-                    
-                    # Specific fix for the "Book" button structure provided by user
-                    # Button HTML: <button ...><span ...>จอง</span>...</button>
-                    # We look for the span with text "จอง" and then click the parent button.
-                    jong_span = visible_dialog.locator('span.YUhpIc-vQzf8d', has_text="จอง")
-                    
-                    # Also try a more general approach targeting the button containing "จอง"
-                    jong_btn_general = visible_dialog.locator('button', has_text="จอง")
-                    
-                    # Try targeting by specific jsname attribute seen in user's HTML
-                    # jsname="hNX5Yc" seems to be the submit button identifier
-                    jong_btn_jsname = visible_dialog.locator('button[jsname="hNX5Yc"]')
-
-                    clicked = False
-                    
-                    if await jong_span.count() > 0:
-                        print("Found 'จอง' span with specific class. Clicking parent button...")
-                        # Get the parent button
-                        parent_btn = jong_span.first.locator("..")
-                        
-                        # Ensure button is in view
-                        await parent_btn.scroll_into_view_if_needed()
-                        
-                        # Use a more human-like click sequence with pointer events
-                        # Some Google buttons rely on pointerdown/up or mousedown/up
-                        
-                        box = await parent_btn.bounding_box()
-                        if box:
-                            # Center coordinates
-                            x = box['x'] + box['width'] / 2
-                            y = box['y'] + box['height'] / 2
-                            
-                            print(f"Moving mouse to coordinates ({x}, {y}) for physical click...")
-                            
-                            # Move mouse in steps to simulate human movement (optional, but helps)
-                            await page.mouse.move(x, y, steps=10)
-                            await page.wait_for_timeout(200)
-                            
-                            # Physical mouse down and up
-                            await page.mouse.down()
-                            await page.wait_for_timeout(100) # Hold click slightly
-                            await page.mouse.up()
-                            
-                            print("Executed physical mouse click.")
-                        else:
-                            # Fallback if box not found (e.g. hidden)
-                            print("Bounding box not found. Fallback to JS dispatch.")
-                            await parent_btn.evaluate("""element => {
-                                const events = ['pointerdown', 'mousedown', 'pointerup', 'mouseup', 'click'];
-                                events.forEach(eventType => {
-                                    const event = new MouseEvent(eventType, {
-                                        bubbles: true,
-                                        cancelable: true,
-                                        view: window,
-                                        buttons: 1
-                                    });
-                                    element.dispatchEvent(event);
-                                });
-                            }""")
-                        
-                        await page.wait_for_timeout(1000) # Wait a bit longer for response
-                        
-                        # Check if dialog closed or success message appeared?
-                        if await parent_btn.is_visible():
-                             print("Button potentially still visible. Trying one last 'force' click directly on span...")
-                             await jong_span.first.click(force=True)
-                        
-                        clicked = True
-                    
-                    elif await jong_btn_jsname.count() > 0:
-                         print("Found button with jsname='hNX5Yc'. Clicking...")
-                         btn = jong_btn_jsname.first
-                         await btn.scroll_into_view_if_needed()
-                         await btn.hover()
-                         await page.wait_for_timeout(200)
-                         
-                         print("Dispatching pointer events on JS-named button...")
-                         await btn.evaluate("""element => {
-                            const events = ['pointerdown', 'mousedown', 'pointerup', 'mouseup', 'click'];
-                            events.forEach(eventType => {
-                                const event = new MouseEvent(eventType, {
-                                    bubbles: true,
-                                    cancelable: true,
-                                    view: window,
-                                    buttons: 1
-                                });
-                                element.dispatchEvent(event);
-                            });
-                        }""")
-                         
-                         await page.wait_for_timeout(500)
-                         # Physical click backup if still visible
-                         if await btn.is_visible():
-                            print("JS-named button still visible, trying physical click...")
-                            await btn.click(force=True)
-                         clicked = True
-                    
-                    elif await jong_btn_general.count() > 0:
-                         print("Found button with text 'จอง'. Clicking...")
-                         await jong_btn_general.first.click(force=True)
-                         clicked = True
-                        
-                    if not clicked:
-                        # Fallback to previous logic
-                        jong_text = visible_dialog.get_by_text("จอง", exact=True)
-                        if await jong_text.count() > 0:
-                             print("Found 'จอง' text element. Clicking...")
-                             await jong_text.first.click(force=True)
-                             clicked = True
-                    
-                    if not clicked and await book_btn.count() > 0:
-                        for i in range(await book_btn.count()):
-                            btn = book_btn.nth(i)
-                            if await btn.is_visible():
-                                print(f"Found 'Book' text element. Clicking...")
-                                await btn.click(force=True)
-                                clicked = True
-                                break
-                                
-                    if not clicked:
-                        # Fallback using get_by_role if explicit text failed
-                        dialog_submit = visible_dialog.get_by_role("button", name=pattern)
-                        
-                        if await dialog_submit.count() > 0:
-                            # Iterate to find the visible one
-                            for i in range(await dialog_submit.count()):
-                                btn = dialog_submit.nth(i)
-                                if await btn.is_visible():
-                                    txt = await btn.inner_text()
-                                    print(f"Clicking dialog button found by role: '{txt}'")
-                                    await btn.click(force=True)
-                                    clicked = True
-                                    break
-                    
-                    if not clicked:
-                        # Fallback: Just click the LAST button in the dialog (usually the primary action)
-                        all_dialog_buttons = visible_dialog.locator("button")
-                        count = await all_dialog_buttons.count()
-                        if count > 0:
-                            print(f"No named button found. Clicking last button in dialog (Button {count})...")
-                            await all_dialog_buttons.last.click(force=True)
-                        else:
-                            print("No buttons found in dialog.")
+                if total_ms > TRACE_SLOW_RUNS_MS:
+                    trace_path = get_result_path("trace", "zip", tag)
+                    await context.tracing.stop(path=trace_path)
+                    print(f"Slow run ({total_ms:.0f} ms), trace saved to {trace_path}")
                 else:
-                    print("No dialog found! Attempting global search...")
-                    
-                if not clicked:
-                    print("Dialog search finished without clicking. Attempting global search for submit button...")
-                    # Submit logic global fallback
-                    scan_text = re.compile(r"^(จอง|Book|Confirm|Schedule)$", re.IGNORECASE)
-                    
-                    # 1. Try finding by Role Button
-                    submit_buttons = page.get_by_role("button", name=scan_text)
-                    count = await submit_buttons.count()
-                    print(f"Found {count} submit buttons globally by role.")
-                    
-                    for i in range(count):
-                        btn = submit_buttons.nth(i)
-                        if await btn.is_visible():
-                            print(f"Clicking visible submit button {i+1} by role...")
-                            await btn.scroll_into_view_if_needed()
-                            await btn.click(force=True)
-                            clicked = True
-                            break
-                            
-                    # 2. Try finding by Text (incase role is missing)
-                    if not clicked:
-                        print("Global role search failed. Trying global text search...")
-                        text_buttons = page.get_by_text(scan_text)
-                        count = await text_buttons.count()
-                        print(f"Found {count} submit buttons globally by text.")
-                        
-                        for i in range(count):
-                            btn = text_buttons.nth(i)
-                            if await btn.is_visible():
-                                print(f"Clicking visible submit button {i+1} by text...")
-                                await btn.scroll_into_view_if_needed()
-                                await btn.click(force=True)
-                                clicked = True
-                                break
-
-                # Wait for confirmation screen
-                print("Waiting for confirmation...")
-                
-                # Check explicitly for success message
-                # "การจองได้รับการยืนยัน" or "Booking confirmed"
-                try:
-                    # Update locator to include the exact text found in user's screenshot: "ยืนยันการจองแล้ว"
-                    success_msg = page.locator("text=Booking confirmed|การจองได้รับการยืนยัน|ยืนยันการนัดหมาย|Confirmed|ยืนยันการจองแล้ว")
-                    await success_msg.first.wait_for(state="visible", timeout=30000)
-                    print("✅ Success! Found confirmation message on page.")
-                except:
-                    print("⚠️ Warning: Could not find explicit 'Booking confirmed' text, but proceeding strictly on timeout.")
-                    # Try to capture HTML for debugging
-                    try: 
-                        with open("debug_page_source.html", "w") as f:
-                            f.write(await page.content())
-                        print("Saved page source to debug_page_source.html")
-                    except: pass
-
-                # Wait longer to ensure backend processes (email sending trigger)
-                print("Waiting 10 seconds for email trigger...")
-                await page.wait_for_timeout(10000) 
-                
-                # Screenshot confirmation
-                confirmation_path = get_screenshot_path("confirmation")
-                await page.screenshot(path=confirmation_path)
-                print(f"Confirmation screenshot saved to {confirmation_path}")
-                print("ℹ️ Please check your email (including Spam/Junk folder) for the confirmation.")
+                    await context.tracing.stop()
+            except Exception as e:
+                print(f"Could not stop tracing: {e}")
 
-        except Exception as e:
-            print(f"An error occurred: {e}")
+        append_run_record({
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "target": target.name,
+            "target_url": target.url,
+            "outcome": outcome,
+            "total_ms": round(total_ms, 1),
+            "phases": {name: round(ms, 1) for name, ms in timer.durations.items()},
+            "spans": timer.spans,
+            "budget_used_pct": timer.budget_usage(),
+            "ready": timer.info.get("ready"),
+            "time_to_first_slot_ms": timer.info.get("time_to_first_slot_ms"),
+            "dialog": timer.info.get("dialog"),
+            "submit_strategy": timer.info.get("submit_strategy"),
+            "confirmation": timer.info.get("confirmation"),
+            "page_metrics": timer.info.get("page_metrics"),
+            "checkpoint": flow.completed,
+            "steps": flow.history,
+            "requests": requests.as_dict(),
+            "blocked": sum(resources.blocked.values()) + sum(resources.stubbed.values()),
+            "artifacts": artifact_paths,
+            "trace": trace_path,
+        })
+        try:
+            await page.close()
+        except:
+            pass
+    return outcome
+
+PROBE_STATE_PATH = os.path.join(CACHE_DIR, "probe_state.json")
+
+# Keep-alive connections reused across probes (one per scheme/host/port)
+_probe_connections = {}
+
+# Per-response noise that changes on every fetch without meaning anything
+PROBE_NOISE = [
+    re.compile(r'nonce="[^"]*"'),
+    re.compile(r"\b\d{10,}\b"),  # epoch timestamps and request ids
+    re.compile(r"\s+"),
+]
+
+def http_get(url, redirects=3):
+    """
+    GET over a pooled keep-alive connection. Returns (status, body bytes).
+    """
+    parsed = urlparse(url)
+    key = (parsed.scheme, parsed.hostname, parsed.port)
+    path = parsed.path or "/"
+    if parsed.query:
+        path += "?" + parsed.query
+    headers = {
+        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+        "Accept-Language": "th-TH,th;q=0.9,en;q=0.8",
+        "Accept-Encoding": "gzip",
+        "Connection": "keep-alive",
+    }
+
+    # A pooled connection may have been closed by the server; retry once on a fresh one
+    for attempt in range(2):
+        connection = _probe_connections.get(key)
+        if connection is None:
+            connection_class = http.client.HTTPSConnection if parsed.scheme == "https" else http.client.HTTPConnection
+            connection = connection_class(parsed.hostname, parsed.port, timeout=PROBE_TIMEOUT_SECONDS)
+            _probe_connections[key] = connection
+        try:
+            connection.request("GET", path, headers=headers)
+            response = connection.getresponse()
+            body = response.read()
+            break
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            _probe_connections.pop(key, None)
+            if attempt:
+                raise
+
+    if response.getheader("Content-Encoding") == "gzip":
+        body = gzip.decompress(body)
+    location = response.getheader("Location")
+    if response.status in (301, 302, 303, 307, 308) and location and redirects:
+        return http_get(urljoin(url, location), redirects - 1)
+    return response.status, body
+
+def probe_fingerprint(body):
+    """
+    Normalizes a probe response and returns its SHA-256.
+    """
+    text = body.decode("utf-8", errors="replace")
+    if PROBE_PATTERN:
+        text = "\n".join(m.group(0) for m in re.finditer(PROBE_PATTERN, text))
+    else:
+        for pattern in PROBE_NOISE:
+            text = pattern.sub(" ", text)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def probe_target():
+    """
+    Decides whether the browser flow needs to run. Returns (run, reason, fingerprint).
+    Any probe failure errs on the side of running the browser.
+    """
+    url = PROBE_URL or TARGET_URL
+    state = load_json(PROBE_STATE_PATH, {}).get(url, {})
+    started = time.perf_counter()
+    try:
+        status, body = http_get(url)
+    except Exception as e:
+        return True, f"probe failed ({e})", None
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    if status != 200:
+        return True, f"probe returned HTTP {status}", None
+    fingerprint = probe_fingerprint(body)
+    print(f"Probe fetched {len(body)} bytes in {elapsed_ms:.0f} ms.")
+
+    if not state.get("fingerprint"):
+        return True, "no stored fingerprint", fingerprint
+    if state["fingerprint"] != fingerprint:
+        return True, "availability changed", fingerprint
+    if state.get("skips_in_row", 0) >= PROBE_MAX_SKIPS:
+        return True, f"{PROBE_MAX_SKIPS} skips in a row", fingerprint
+    return False, "unchanged", fingerprint
+
+def record_probe(escalated, fingerprint, outcome=None):
+    """
+    Updates the probe counters. The fingerprint is only remembered once a
+    browser run actually looked at that state, and is dropped after an
+    error so the next run escalates again.
+    """
+    url = PROBE_URL or TARGET_URL
+    cache = load_json(PROBE_STATE_PATH, {})
+    state = cache.setdefault(url, {"skipped": 0, "escalated": 0, "skips_in_row": 0})
+    if escalated:
+        state["escalated"] = state.get("escalated", 0) + 1
+        state["skips_in_row"] = 0
+        state["fingerprint"] = fingerprint if outcome != "error" else None
+    else:
+        state["skipped"] = state.get("skipped", 0) + 1
+        state["skips_in_row"] = state.get("skips_in_row", 0) + 1
+    state["last_checked"] = datetime.now().isoformat(timespec="seconds")
+    try:
+        save_json(PROBE_STATE_PATH, cache)
+    except OSError as e:
+        print(f"Could not save probe state: {e}")
+    print(f"Probe counters: {state['skipped']} skipped, {state['escalated']} escalated.")
+
+async def probe_gate():
+    """
+    Runs the HTTP probe off the event loop. Returns (run, fingerprint);
+    a skipped run is recorded here and in the run log.
+    """
+    if not PROBE_ENABLED:
+        return True, None
+    run, reason, fingerprint = await asyncio.get_running_loop().run_in_executor(None, probe_target)
+    if run:
+        print(f"Probe: {reason}. Starting the browser flow.")
+        return True, fingerprint
+
+    print("Probe: target unchanged since the last browser run. Skipping the browser.")
+    record_probe(False, fingerprint)
+    append_run_record({
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "target_url": TARGET_URL,
+        "outcome": "skipped",
+        "probe": reason,
+    })
+    return False, fingerprint
+
+def check_config(targets=None):
+    # Helper to check environment variables (or the targets file)
+    single = targets is None
+    if single:
+        try:
+            targets = [default_target()]
+        except ValueError as e:
+            print(f"Error: {e}. Please check your .env file.")
+            sys.exit(1)
+    for target in targets:
+        missing = target.missing_fields()
+        if missing:
+            where = "environment variables" if single else f"target '{target.name}'"
+            print(f"Error: Missing {', '.join(missing)} for {where}. Please check your .env file.")
+            sys.exit(1)
+
+async def book_appointment():
+    if TARGETS_FILE:
+        try:
+            targets = load_targets(TARGETS_FILE)
+        except (OSError, KeyError, ValueError) as e:
+            print(f"Error: could not load TARGETS_FILE {TARGETS_FILE}: {e}")
+            sys.exit(1)
+        return await run_targets(targets)
+    check_config()
+
+    # Cheap pre-check before paying for a browser launch
+    run, fingerprint = await probe_gate()
+    if not run:
+        return "skipped"
+
+    outcome = "error"
+    try:
+        async with async_playwright() as p:
+            browser = await launch_browser(p)
             try:
-                await page.screenshot(path=get_screenshot_path("error"))
-            except:
-                pass
+                context = await new_booking_context(browser)
+                outcome = await run_booking(context)
+            finally:
+                await browser.close()
+    finally:
+        if PROBE_ENABLED:
+            record_probe(True, fingerprint, outcome)
+    return outcome
+
+def process_tree(pid=None):
+    """
+    Returns the pids of a process and all of its descendants (the
+    Playwright driver and every Chromium process) by reading /proc.
+    Returns None where /proc is not available.
+    """
+    pid = pid or os.getpid()
+    if not os.path.isdir("/proc"):
+        return None
+
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name may contain spaces, so split after its closing bracket
+        ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+
+    pids = []
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        pids.append(current)
+        stack.extend(children.get(current, []))
+    return pids
+
+def process_rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+def process_tree_rss_mb(pid=None):
+    """
+    Sums the resident memory of a process and all of its descendants.
+    Returns None where /proc is not available.
+    """
+    pids = process_tree(pid)
+    if pids is None:
+        return None
+    return sum(process_rss_kb(p) for p in pids) / 1024
+
+async def run_daemon():
+    """
+    Keeps one Chromium and a warmed context alive and runs the booking flow
+    every DAEMON_INTERVAL_SECONDS. The context is recycled after
+    DAEMON_RECYCLE_RUNS runs or once the process tree passes DAEMON_MAX_RSS_MB.
+    """
+    check_config()
+    print(f"Daemon mode: running every {DAEMON_INTERVAL_SECONDS}s, recycling context after {DAEMON_RECYCLE_RUNS} runs or {DAEMON_MAX_RSS_MB} MB.")
+
+    cold_times = []
+    warm_times = []
+    total_runs = 0
+
+    async with async_playwright() as p:
+        browser = None
+        context = None
+        context_runs = 0
+        try:
+            while DAEMON_MAX_RUNS == 0 or total_runs < DAEMON_MAX_RUNS:
+                started = time.perf_counter()
+                cold = False
+
+                run, fingerprint = await probe_gate()
+                if not run:
+                    total_runs += 1
+                    if DAEMON_MAX_RUNS and total_runs >= DAEMON_MAX_RUNS:
+                        break
+                    await asyncio.sleep(max(0, DAEMON_INTERVAL_SECONDS - (time.perf_counter() - started)))
+                    continue
+
+                try:
+                    if browser is None or not browser.is_connected():
+                        browser = await launch_browser(p)
+                        context = None
+                    if context is None:
+                        cold = True
+                        context = await new_booking_context(browser)
+                        context_runs = 0
+
+                    outcome = await run_booking(context)
+                except Exception as e:
+                    print(f"Daemon run failed: {e}")
+                    outcome = "error"
+                    # Start from a clean browser next time
+                    try:
+                        if browser is not None:
+                            await browser.close()
+                    except:
+                        pass
+                    browser = None
+                    context = None
+                if PROBE_ENABLED:
+                    record_probe(True, fingerprint, outcome)
+
+                elapsed = time.perf_counter() - started
+                (cold_times if cold else warm_times).append(elapsed)
+                total_runs += 1
+                context_runs += 1
+
+                rss = process_tree_rss_mb()
+                rss_text = f"{rss:.0f} MB" if rss is not None else "n/a"
+                print(f"Run {total_runs} ({'cold' if cold else 'warm'}): {outcome} in {elapsed:.2f}s, process tree RSS {rss_text}")
+                if cold_times and warm_times:
+                    cold_avg = sum(cold_times) / len(cold_times)
+                    warm_avg = sum(warm_times) / len(warm_times)
+                    print(f"Average cold run {cold_avg:.2f}s ({len(cold_times)}) vs warm run {warm_avg:.2f}s ({len(warm_times)})")
+
+                if outcome == "confirmed" and DAEMON_STOP_ON_SUCCESS:
+                    print("Booking confirmed. Stopping daemon.")
+                    break
+
+                if context is not None and (context_runs >= DAEMON_RECYCLE_RUNS or (rss is not None and rss > DAEMON_MAX_RSS_MB)):
+                    print(f"Recycling browser context after {context_runs} runs.")
+                    await context.close()
+                    context = None
+
+                if DAEMON_MAX_RUNS and total_runs >= DAEMON_MAX_RUNS:
+                    break
+                await asyncio.sleep(max(0, DAEMON_INTERVAL_SECONDS - elapsed))
+        finally:
+            if browser is not None:
+                await browser.close()
+
+def set_data_dirs(cache_dir, results_dir):
+    """
+    Points every cache file, the run log and the artifacts at other
+    directories, e.g. a temporary one for benchmark and profiling runs
+    so they leave the real .cache/ and results/ alone.
+    """
+    global CACHE_DIR, RESULTS_DIR, RUN_LOG_PATH, SLOT_INDEX_PATH, RESOURCE_SIZES_PATH
+    global SUBMIT_CACHE_PATH, FORM_CACHE_PATH, CHECKPOINT_PATH, PROBE_STATE_PATH
+    CACHE_DIR = cache_dir
+    RESULTS_DIR = results_dir
+    RUN_LOG_PATH = os.path.join(results_dir, "runs.jsonl")
+    SLOT_INDEX_PATH = os.path.join(cache_dir, "slot_index.json")
+    RESOURCE_SIZES_PATH = os.path.join(cache_dir, "resource_sizes.json")
+    SUBMIT_CACHE_PATH = os.path.join(cache_dir, "submit_strategies.json")
+    FORM_CACHE_PATH = os.path.join(cache_dir, "form_fields.json")
+    CHECKPOINT_PATH = os.path.join(cache_dir, "checkpoints.json")
+    PROBE_STATE_PATH = os.path.join(cache_dir, "probe_state.json")
+
+class HostRateLimiter:
+    """
+    Spaces page loads to the same host at least min_interval_ms apart,
+    however many targets share it. Each caller reserves the next free
+    start time, so waiting callers start in order.
+    """
+
+    def __init__(self, min_interval_ms):
+        self.min_interval = min_interval_ms / 1000
+        self.next_start = {}
+
+    async def wait(self, url):
+        host = urlparse(url).netloc
+        now = time.monotonic()
+        start = max(now, self.next_start.get(host, 0))
+        self.next_start[host] = start + self.min_interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+def print_targets_report(results, peak_rss, elapsed):
+    print()
+    print(f"{'target':<24} {'outcome':<12} {'total s':>8} {'JS heap MB':>11} {'DOM nodes':>10}  phases")
+    for name, result in results.items():
+        metrics = result["page_metrics"] or {}
+        phases = ", ".join(f"{phase} {ms / 1000:.1f}s" for phase, ms in result["phases"].items())
+        print(f"{name[:24]:<24} {result['outcome']:<12} {result['total_ms'] / 1000:>8.2f} "
+              f"{metrics.get('js_heap_used_mb', 0):>11.1f} {metrics.get('nodes', 0):>10}  {phases}")
+    rss_text = f"{peak_rss:.0f} MB" if peak_rss else "n/a"
+    print(f"{len(results)} targets in {elapsed:.2f}s, peak process tree RSS {rss_text}")
+
+async def run_targets(targets):
+    """
+    Checks several targets with one shared Chromium, each run in its own
+    context. At most TARGETS_CONCURRENCY run at a time and page loads to
+    the same host are TARGETS_HOST_INTERVAL_MS apart. Once a booking is
+    confirmed, pending runs for the same person are cancelled (unless
+    they already clicked submit). Returns {target name: outcome}.
+    """
+    check_config(targets)
+    print(f"Checking {len(targets)} targets, {TARGETS_CONCURRENCY} at a time.")
+    semaphore = asyncio.Semaphore(max(1, TARGETS_CONCURRENCY))
+    limiter = HostRateLimiter(TARGETS_HOST_INTERVAL_MS)
+    booked = set()
+    tasks = {}
+    timers = {}
+    results = {}
+    peak_rss = 0
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while True:
+            rss = process_tree_rss_mb()
+            if rss is None:
+                return
+            peak_rss = max(peak_rss, rss)
+            await asyncio.sleep(0.5)
+
+    async def run_target(browser, target):
+        outcome = "error"
+        timer = None
+        try:
+            async with semaphore:
+                if target.person in booked:
+                    outcome = "cancelled"
+                    return outcome
+                # Latency is measured from here, not from the start of the queue
+                timer = timers[target.name] = PhaseTimer()
+                context = await new_booking_context(browser)
+                try:
+                    outcome = await run_booking(context, timer, target, limiter, metrics=True)
+                finally:
+                    await context.close()
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
         finally:
+            if timer is not None:
+                timer.end()
+            results[target.name] = {
+                "outcome": outcome,
+                "total_ms": timer.total_ms() if timer is not None else 0,
+                "phases": timer.durations if timer is not None else {},
+                "page_metrics": timer.info.get("page_metrics") if timer is not None else None,
+            }
+
+        if outcome == "confirmed":
+            booked.add(target.person)
+            for other in targets:
+                task = tasks[other.name]
+                other_timer = timers.get(other.name)
+                # A run that has clicked submit is left to report its answer
+                clicked = other_timer is not None and "submit_clicked_at" in other_timer.info
+                if other is not target and other.person == target.person and not task.done() and not clicked:
+                    print(f"Booked for {target.person}; cancelling {other.name}.")
+                    task.cancel()
+        return outcome
+
+    started = time.perf_counter()
+    async with async_playwright() as p:
+        browser = await launch_browser(p)
+        sampler = asyncio.ensure_future(sample_rss())
+        try:
+            for target in targets:
+                tasks[target.name] = asyncio.ensure_future(run_target(browser, target))
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+        finally:
+            sampler.cancel()
             await browser.close()
 
+    print_targets_report(results, peak_rss, time.perf_counter() - started)
+    return {name: result["outcome"] for name, result in results.items()}
+
 if __name__ == "__main__":
-    asyncio.run(book_appointment())
+    if "--daemon" in sys.argv[1:]:
+        asyncio.run(run_daemon())
+    else:
+        asyncio.run(book_appointment())
@@ -0,0 +1,157 @@
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Offline stand-in for the appointment page so the bot can be run and
+# benchmarked without touching the live TARGET_URL.
+#
+#   python fixture_server.py --port 8765 --latency-ms 150
+#   TARGET_URL=http://127.0.0.1:8765/ python bot.py
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+THAI_DAYS = ["วันจันทร์", "วันอังคาร", "วันพุธ", "วันพฤหัสบดี", "วันศุกร์", "วันเสาร์", "วันอาทิตย์"]
+THAI_MONTHS = ["มกราคม", "กุมภาพันธ์", "มีนาคม", "เมษายน", "พฤษภาคม", "มิถุนายน",
+               "กรกฎาคม", "สิงหาคม", "กันยายน", "ตุลาคม", "พฤศจิกายน", "ธันวาคม"]
+SLOT_TIMES = ["9:00", "10:00", "11:00", "13:00", "14:00", "15:00"]
+
+class FixtureState:
+    """
+    Slot availability shared by all requests. The first `free_slots` unbooked
+    slots late in the first week are bookable; `free_slots=0` renders a page
+    with nothing bookable.
+    """
+
+    def __init__(self, free_slots=3, start=None):
+        self.lock = threading.Lock()
+        self.start = start or date.today() + timedelta(days=1)
+        self.free_slots = free_slots
+        self.bookings = []
+
+    def week(self, offset):
+        days = []
+        free_left = self.free_slots if offset == 0 else 0
+        for i in range(5):
+            day = self.start + timedelta(days=offset * 7 + i)
+            label = f"{THAI_DAYS[day.weekday()]} {day.day} {THAI_MONTHS[day.month - 1]}"
+            slots = []
+            for slot_time in SLOT_TIMES:
+                slot_id = f"{day.isoformat()}T{slot_time}"
+                booked = any(b["slot"] == slot_id for b in self.bookings)
+                # Free slots sit at the end of the first week so the scan has to walk past disabled ones
+                available = not booked and free_left > 0 and i >= 3
+                if available:
+                    free_left -= 1
+                slots.append({"id": slot_id, "time": slot_time, "available": available})
+            days.append({"date": day.isoformat(), "label": label, "slots": slots})
+        return days
+
+    def reset(self):
+        with self.lock:
+            self.bookings = []
+
+    def book(self, data):
+        with self.lock:
+            if any(b["slot"] == data.get("slot") for b in self.bookings):
+                return 409, {"status": "rejected", "message": "ช่วงเวลานี้ถูกจองแล้ว"}
+            missing = [k for k in ("first_name", "last_name", "email") if not data.get(k)]
+            if missing:
+                return 400, {"status": "rejected", "message": f"missing {', '.join(missing)}"}
+            self.bookings.append(data)
+            return 200, {"status": "confirmed", "booking_id": len(self.bookings)}
+
+def make_handler(state, latency_ms, jitter_ms):
+    class FixtureHandler(BaseHTTPRequestHandler):
+        # Keep-alive, so pooled clients (like the HTTP probe) reuse connections
+        protocol_version = "HTTP/1.1"
+        # Headers and body go out in separate writes; without TCP_NODELAY, Nagle
+        # and delayed ACK add ~40 ms to every reused connection
+        disable_nagle_algorithm = True
+        pages = {
+            "/": "slots.html",
+            "/form.html": "form.html",
+            "/confirmation.html": "confirmation.html",
+        }
+
+        def log_message(self, format, *args):
+            pass
+
+        def _delay(self):
+            if latency_ms or jitter_ms:
+                time.sleep((latency_ms + random.uniform(0, jitter_ms)) / 1000)
+
+        def _send(self, status, body, content_type):
+            if isinstance(body, str):
+                body = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_json(self, status, data):
+            self._send(status, json.dumps(data, ensure_ascii=False), "application/json; charset=utf-8")
+
+        def do_GET(self):
+            self._delay()
+            url = urlparse(self.path)
+            if url.path in self.pages:
+                with open(os.path.join(FIXTURE_DIR, self.pages[url.path]), encoding="utf-8") as f:
+                    self._send(200, f.read(), "text/html; charset=utf-8")
+            elif url.path == "/api/slots":
+                week = int(parse_qs(url.query).get("week", ["0"])[0])
+                with state.lock:
+                    self._send_json(200, state.week(week))
+            else:
+                self._send(404, "not found", "text/plain")
+
+        def do_POST(self):
+            self._delay()
+            if urlparse(self.path).path != "/api/book":
+                self._send(404, "not found", "text/plain")
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                data = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                self._send_json(400, {"status": "rejected", "message": "bad json"})
+                return
+            status, result = state.book(data)
+            self._send_json(status, result)
+
+    return FixtureHandler
+
+def start_fixture_server(port=0, latency_ms=0, jitter_ms=0, free_slots=3):
+    """
+    Starts the fixture server on a background thread.
+    Returns (server, base_url); call server.shutdown() to stop it.
+    """
+    state = FixtureState(free_slots=free_slots)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state, latency_ms, jitter_ms))
+    server.state = state
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the offline booking fixtures.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=int, default=0, help="delay added to every response")
+    parser.add_argument("--jitter-ms", type=int, default=0, help="random extra delay up to this much")
+    parser.add_argument("--free-slots", type=int, default=3, help="bookable slots in the first week")
+    args = parser.parse_args()
+
+    server, url = start_fixture_server(args.port, args.latency_ms, args.jitter_ms, args.free_slots)
+    print(f"Serving booking fixtures at {url} (latency {args.latency_ms} ms, jitter {args.jitter_ms} ms)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,291 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from playwright.async_api import async_playwright
+
+import bot
+from benchmark import percentile
+from fixture_server import start_fixture_server
+
+# Samples RSS and CPU of this Python process, the Playwright driver and
+# every Chromium process through each phase of the booking flow, reads
+# Chromium's own counters (JS heap, DOM nodes, layouts) over CDP at the end
+# of each phase, and compares launch/context configurations against the
+# offline fixtures.
+#
+#   python profile_browser.py --runs 3
+#   python profile_browser.py --configs current,dsf1,lean --json results/profile.json
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+GROUPS = ["python", "driver", "browser"]
+
+# Flags that slim down headless Chromium on small machines. Others often
+# listed with them (--disable-dev-shm-usage, --disable-extensions,
+# --disable-background-networking) are on Playwright's default command line
+# already, so they would change nothing here.
+LEAN_ARGS = [
+    "--disable-gpu",
+    "--disable-software-rasterizer",
+    "--renderer-process-limit=1",
+]
+
+def build_configs():
+    """
+    The bot's current launch/context settings and variations of them.
+    """
+    args = bot.LAUNCH_ARGS.split() or bot.DEFAULT_LAUNCH_ARGS
+    viewport = bot.parse_viewport(bot.VIEWPORT)
+    small = {"width": 800, "height": 600}
+    return {
+        "current": {"args": args, "viewport": viewport, "device_scale_factor": bot.DEVICE_SCALE_FACTOR},
+        "dsf1": {"args": args, "viewport": viewport, "device_scale_factor": 1},
+        "small": {"args": args, "viewport": small, "device_scale_factor": 1},
+        # Chromium's default process model, without the IsolateOrigins/site-per-process switch
+        "site_isolation": {
+            "args": [a for a in args if not a.startswith("--disable-features=")],
+            "viewport": viewport,
+            "device_scale_factor": bot.DEVICE_SCALE_FACTOR,
+        },
+        "lean": {"args": args + LEAN_ARGS, "viewport": small, "device_scale_factor": 1},
+    }
+
+def read_process(pid):
+    """
+    Returns (command name, CPU ticks, RSS kB) for a pid, or None once it has exited.
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    name = stat[stat.index("(") + 1:stat.rindex(")")]
+    # Fields after the command name start at "state"; utime and stime are the 12th and 13th
+    fields = stat.rsplit(")", 1)[1].split()
+    return name, int(fields[11]) + int(fields[12]), bot.process_rss_kb(pid)
+
+def process_group(pid, name):
+    if pid == os.getpid():
+        return "python"
+    if "node" in name or "playwright" in name:
+        return "driver"
+    return "browser"
+
+class ProcessSampler:
+    """
+    Samples the process tree every interval_ms and attributes each sample
+    to the phase running at the time: the attached timer's current phase,
+    or `phase` outside of them (launch, context, bookkeeping, teardown).
+    When the phase changes, the page's CDP metrics are read as the end
+    state of the phase that just finished.
+    """
+
+    def __init__(self, interval_ms):
+        self.interval = interval_ms / 1000
+        self.phase = "launch"
+        self.timer = None
+        self.phases = {}
+        self.cpu_seen = {}
+        self._last_label = None
+        self._task = None
+
+    def label(self):
+        if self.timer is not None and self.timer.current is not None:
+            return self.timer.current
+        return self.phase
+
+    def _stats(self, label):
+        return self.phases.setdefault(label, {
+            "samples": 0,
+            "rss_peak_mb": {group: 0.0 for group in GROUPS + ["total"]},
+            "cpu_ms": {group: 0.0 for group in GROUPS + ["total"]},
+            "cdp": {},
+        })
+
+    def sample(self):
+        pids = bot.process_tree()
+        if pids is None:
+            return
+        stats = self._stats(self.label())
+        stats["samples"] += 1
+        rss = {group: 0 for group in GROUPS}
+        for pid in pids:
+            info = read_process(pid)
+            if info is None:
+                continue
+            name, ticks, rss_kb = info
+            group = process_group(pid, name)
+            rss[group] += rss_kb
+            # A process seen for the first time is charged everything since it started
+            delta_ms = (ticks - self.cpu_seen.get(pid, 0)) * 1000 / CLOCK_TICKS
+            self.cpu_seen[pid] = ticks
+            stats["cpu_ms"][group] += delta_ms
+            stats["cpu_ms"]["total"] += delta_ms
+        peaks = stats["rss_peak_mb"]
+        for group in GROUPS:
+            peaks[group] = max(peaks[group], rss[group] / 1024)
+        peaks["total"] = max(peaks["total"], sum(rss.values()) / 1024)
+
+    async def _read_cdp(self, label):
+        if self.timer is not None and self.timer.metrics is not None:
+            self._stats(label)["cdp"] = await self.timer.metrics.read()
+
+    async def _run(self):
+        while True:
+            label = self.label()
+            if self._last_label is not None and label != self._last_label:
+                await self._read_cdp(self._last_label)
+            self._last_label = label
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        # CPU already spent by running processes (imports, the fixture server) isn't part of any phase
+        for pid in bot.process_tree() or []:
+            info = read_process(pid)
+            if info is not None:
+                self.cpu_seen[pid] = info[1]
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self.sample()
+
+async def profile_config(p, name, config, runs, server, interval_ms):
+    print(f"\n[{name}] args={' '.join(config['args'])} viewport={config['viewport']['width']}x{config['viewport']['height']} "
+          f"dsf={config['device_scale_factor']}")
+    sampler = ProcessSampler(interval_ms)
+    sampler.start()
+    started = time.perf_counter()
+    browser = await bot.launch_browser(p, config["args"])
+    launch_ms = (time.perf_counter() - started) * 1000
+
+    runs_out = []
+    try:
+        for i in range(runs):
+            server.state.reset()
+            sampler.phase = "context"
+            context = await bot.new_booking_context(browser, config["viewport"], config["device_scale_factor"])
+            # Page setup before the first phase and the bookkeeping after the last
+            sampler.phase = "bookkeeping"
+            timer = bot.PhaseTimer()
+            sampler.timer = timer
+            outcome = await bot.run_booking(context, timer, metrics=True)
+            sampler.timer = None
+            sampler.phase = "teardown"
+            await context.close()
+            # The flow's last phase is only read once the run has finished
+            if timer.spans:
+                sampler.phases.get(timer.spans[-1]["name"], {})["cdp"] = timer.info.get("page_metrics") or {}
+            runs_out.append({"outcome": outcome, "total_ms": timer.total_ms(), "page_metrics": timer.info.get("page_metrics") or {}})
+            print(f"Run {i + 1}/{runs}: {outcome} in {timer.total_ms():.0f} ms")
+    finally:
+        await browser.close()
+        await sampler.stop()
+
+    return {"config": config, "launch_ms": launch_ms, "runs": runs_out, "phases": sampler.phases}
+
+def completes(result, free_slots):
+    expected = "confirmed" if free_slots else "no_slots"
+    return all(run["outcome"] == expected for run in result["runs"])
+
+def summarize(result):
+    phases = result["phases"].values()
+    runs = len(result["runs"]) or 1
+    heaps = [run["page_metrics"].get("js_heap_used_mb", 0) for run in result["runs"]]
+    nodes = [run["page_metrics"].get("nodes", 0) for run in result["runs"]]
+    return {
+        "run_p50_ms": percentile([run["total_ms"] for run in result["runs"]], 50),
+        "rss_peak_mb": max((s["rss_peak_mb"]["total"] for s in phases), default=0),
+        "browser_rss_peak_mb": max((s["rss_peak_mb"]["browser"] for s in phases), default=0),
+        "cpu_ms_per_run": sum(s["cpu_ms"]["total"] for s in phases) / runs,
+        "js_heap_peak_mb": max([s["cdp"].get("js_heap_used_mb", 0) for s in phases] + heaps, default=0),
+        "nodes_peak": max([s["cdp"].get("nodes", 0) for s in phases] + nodes, default=0),
+    }
+
+def print_report(results, free_slots):
+    print()
+    print(f"{'config':<16} {'ok':>3} {'launch ms':>10} {'run p50':>9} {'RSS MB':>8} {'browser':>8} {'CPU ms/run':>11} {'JS heap':>8} {'nodes':>7}")
+    for name, result in results.items():
+        summary = summarize(result)
+        print(f"{name:<16} {'yes' if completes(result, free_slots) else 'no':>3} {result['launch_ms']:>10.0f} "
+              f"{summary['run_p50_ms']:>9.0f} {summary['rss_peak_mb']:>8.0f} {summary['browser_rss_peak_mb']:>8.0f} "
+              f"{summary['cpu_ms_per_run']:>11.0f} {summary['js_heap_peak_mb']:>8.1f} {summary['nodes_peak']:>7}")
+
+    for name, result in results.items():
+        print(f"\n[{name}] per phase (RSS peak MB / CPU ms, summed over runs)")
+        print(f"{'phase':<12} {'python':>14} {'driver':>14} {'browser':>14} {'JS heap':>8} {'nodes':>7} {'layouts':>8}")
+        for phase, stats in result["phases"].items():
+            cells = [f"{stats['rss_peak_mb'][g]:.0f} / {stats['cpu_ms'][g]:.0f}" for g in GROUPS]
+            cdp = stats["cdp"]
+            print(f"{phase:<12} {cells[0]:>14} {cells[1]:>14} {cells[2]:>14} "
+                  f"{cdp.get('js_heap_used_mb', ''):>8} {cdp.get('nodes', ''):>7} {cdp.get('layout_count', ''):>8}")
+
+    finished = {name: summarize(r) for name, r in results.items() if completes(r, free_slots)}
+    if finished:
+        cheapest = min(finished, key=lambda name: (finished[name]["rss_peak_mb"], finished[name]["cpu_ms_per_run"]))
+        print(f"\nCheapest configuration that completed every run: {cheapest} "
+              f"({finished[cheapest]['rss_peak_mb']:.0f} MB peak, {finished[cheapest]['cpu_ms_per_run']:.0f} ms CPU per run)")
+    else:
+        print("\nNo configuration completed every run.")
+
+async def run_profile(names, runs, latency_ms, free_slots, interval_ms, data_dir=None):
+    configs = build_configs()
+    server, url = start_fixture_server(latency_ms=latency_ms, free_slots=free_slots)
+    print(f"Fixture server at {url} (latency {latency_ms} ms)")
+
+    # Point the bot at the fixtures and fill in placeholder details if .env has none
+    bot.TARGET_URL = url
+    for name, value in (("FIRST_NAME", "Profile"), ("LAST_NAME", "Runner"), ("EMAIL", "profile@example.com"),
+                        ("PHONE", "0800000000"), ("STUDENT_ID", "6500000000")):
+        if not getattr(bot, name):
+            setattr(bot, name, value)
+
+    # Keep caches, run records and artifacts of fixture runs out of the real .cache/ and results/
+    temporary = data_dir is None
+    data_dir = data_dir or tempfile.mkdtemp(prefix="booking-profile-")
+    bot.set_data_dirs(os.path.join(data_dir, "cache"), os.path.join(data_dir, "results"))
+    print(f"Caches and results for this run go to {data_dir}")
+
+    results = {}
+    try:
+        async with async_playwright() as p:
+            for name in names:
+                results[name] = await profile_config(p, name, configs[name], runs, server, interval_ms)
+    finally:
+        server.shutdown()
+        if temporary:
+            shutil.rmtree(data_dir, ignore_errors=True)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile the browser footprint of the booking flow per phase and configuration.")
+    parser.add_argument("--configs", default=",".join(build_configs()), help="comma separated: " + ", ".join(build_configs()))
+    parser.add_argument("--runs", type=int, default=3, help="booking runs per configuration (one browser launch each)")
+    parser.add_argument("--latency-ms", type=int, default=0)
+    parser.add_argument("--free-slots", type=int, default=3, help="0 profiles the 'no slots' path")
+    parser.add_argument("--interval-ms", type=int, default=100, help="process sampling interval")
+    parser.add_argument("--json", help="also write the raw results to this file")
+    parser.add_argument("--data-dir", help="keep caches, run records and artifacts here (default: a temporary directory)")
+    args = parser.parse_args()
+
+    names = bot.split_list(args.configs)
+    unknown = [name for name in names if name not in build_configs()]
+    if unknown:
+        parser.error(f"unknown configuration(s): {', '.join(unknown)}")
+
+    results = asyncio.run(run_profile(names, args.runs, args.latency_ms, args.free_slots, args.interval_ms, args.data_dir))
+    print_report(results, args.free_slots)
+    if args.json:
+        os.makedirs(os.path.dirname(args.json) or ".", exist_ok=True)
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
@@ -0,0 +1,15 @@
+import bot
+
+def test_slugify_keeps_names_readable():
+    assert bot.slugify("Visa Office (Main)").startswith("visa-office-main-")
+    assert bot.slugify("ห้องสมุดกลาง").startswith("ห้องสมุดกลาง-")
+
+def test_slugify_keeps_names_apart():
+    names = ["ห้องสมุดกลาง", "ห้องประชุม", "Room A", "room-a", "!!!", "???"]
+    assert len({bot.slugify(name) for name in names}) == len(names)
+
+def test_result_path_carries_the_tag(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, "RESULTS_DIR", str(tmp_path))
+    path = bot.get_result_path("shot", "jpg", bot.slugify("ห้องประชุม"))
+    assert path.startswith(str(tmp_path))
+    assert "_ห้องประชุม-" in path and path.endswith("_shot.jpg")
@@ -0,0 +1,7 @@
+from benchmark import percentile
+
+def test_percentile_is_nearest_rank():
+    assert percentile([5, 1, 4, 2, 3], 50) == 3
+    assert percentile(list(range(1, 31)), 95) == 29
+    assert percentile([7], 95) == 7
+    assert percentile([], 50) == 0.0
@@ -0,0 +1,59 @@
+import pytest
+
+import bot
+from fixture_server import start_fixture_server
+
+DATA_GLOBALS = ["CACHE_DIR", "RESULTS_DIR", "RUN_LOG_PATH", "SLOT_INDEX_PATH", "RESOURCE_SIZES_PATH",
+                "SUBMIT_CACHE_PATH", "FORM_CACHE_PATH", "CHECKPOINT_PATH", "PROBE_STATE_PATH"]
+
+@pytest.fixture
+def fixture_site(tmp_path, monkeypatch):
+    """
+    The fixture server as probe target, with probe state in a temp directory.
+    """
+    for name in DATA_GLOBALS:
+        monkeypatch.setattr(bot, name, getattr(bot, name))
+    bot.set_data_dirs(str(tmp_path / "cache"), str(tmp_path / "results"))
+    server, url = start_fixture_server()
+    # The slot list is what changes when a slot gets booked
+    monkeypatch.setattr(bot, "PROBE_URL", url + "api/slots?week=0")
+    monkeypatch.setattr(bot, "PROBE_PATTERN", "")
+    monkeypatch.setattr(bot, "PROBE_MAX_SKIPS", 2)
+    yield server
+    for connection in bot._probe_connections.values():
+        connection.close()
+    bot._probe_connections.clear()
+    server.shutdown()
+
+def book_first_free_slot(server):
+    slot = next(s for day in server.state.week(0) for s in day["slots"] if s["available"])
+    assert server.state.book({"slot": slot["id"], "first_name": "A", "last_name": "B", "email": "a@b.c"})[0] == 200
+
+def test_unchanged_page_is_skipped(fixture_site):
+    run, reason, fingerprint = bot.probe_target()
+    assert (run, reason) == (True, "no stored fingerprint")
+    bot.record_probe(True, fingerprint, "no_slots")
+
+    run, reason, again = bot.probe_target()
+    assert (run, reason, again) == (False, "unchanged", fingerprint)
+
+def test_changed_availability_escalates(fixture_site):
+    bot.record_probe(True, bot.probe_target()[2], "no_slots")
+    book_first_free_slot(fixture_site)
+    run, reason, _ = bot.probe_target()
+    assert (run, reason) == (True, "availability changed")
+
+def test_escalates_after_max_skips(fixture_site):
+    bot.record_probe(True, bot.probe_target()[2], "no_slots")
+    for _ in range(2):
+        run, _, fingerprint = bot.probe_target()
+        assert not run
+        bot.record_probe(False, fingerprint)
+    run, reason, _ = bot.probe_target()
+    assert (run, reason) == (True, "2 skips in a row")
+
+def test_error_drops_fingerprint(fixture_site):
+    fingerprint = bot.probe_target()[2]
+    bot.record_probe(True, fingerprint, "error")
+    run, reason, _ = bot.probe_target()
+    assert (run, reason) == (True, "no stored fingerprint")
@@ -0,0 +1,74 @@
+from datetime import date
+
+import pytest
+
+import bot
+
+TODAY = date(2025, 10, 17)
+
+@pytest.mark.parametrize("text, expected", [
+    ("9:00", "09:00"),
+    ("2:30 pm", "14:30"),
+    ("12:15 a.m.", "00:15"),
+    ("13:00, วันพุธ 21 ตุลาคม", "13:00"),
+    ("no time here", None),
+])
+def test_parse_slot_time(text, expected):
+    assert bot.parse_slot_time(text) == expected
+
+@pytest.mark.parametrize("text, expected", [
+    ("9:00, วันพุธ 21 ตุลาคม", "2025-10-21"),
+    ("October 21, 10:00 AM", "2025-10-21"),
+    ("21 ต.ค. 2568", "2025-10-21"),
+    ("Wednesday, October 21, 2026", "2026-10-21"),
+    # Early in the year means next year once we're late in this one
+    ("5 มกราคม", "2026-01-05"),
+    # A four-digit room number is not a year
+    ("14:00 ห้อง 1203 Mon 3 Nov", "2025-11-03"),
+    ("3 Nov 1203", "2025-11-03"),
+    ("31 กุมภาพันธ์", None),
+    ("Room 12", None),
+])
+def test_parse_slot_date(text, expected):
+    assert bot.parse_slot_date(text, today=TODAY) == expected
+
+def test_parse_time_windows():
+    assert bot.parse_time_windows("09:00-12:00, 13:00-16:30") == [("09:00", "12:00"), ("13:00", "16:30")]
+    assert bot.parse_time_windows("9-12") == [("09:00", "12:00")]
+    assert bot.parse_time_windows(["1:00 pm-3:00 pm"]) == [("13:00", "15:00")]
+    assert bot.parse_time_windows("") == []
+
+@pytest.mark.parametrize("value", ["9", "nine-12", "09:00-25:00", "9:75-10"])
+def test_parse_time_windows_rejects_bad_entries(value):
+    with pytest.raises(ValueError):
+        bot.parse_time_windows(value)
+
+def test_parse_weekdays():
+    assert bot.parse_weekdays("Monday, wed") == ["mon", "wed"]
+    with pytest.raises(ValueError):
+        bot.parse_weekdays("someday")
+
+def test_slot_matches_preferences():
+    target = bot.Target("http://example/", {}, time_windows="09:00-12:00", weekdays="tue")
+    assert bot.slot_matches_preferences({"time": "10:00", "date": "2025-10-21"}, target)
+    assert not bot.slot_matches_preferences({"time": "13:00", "date": "2025-10-21"}, target)
+    assert not bot.slot_matches_preferences({"time": "10:00", "date": "2025-10-22"}, target)
+    # Unknown dates pass the weekday filter
+    assert bot.slot_matches_preferences({"time": "10:00", "date": None}, target)
+
+def test_diff_slot_index():
+    previous = {"a": {"enabled": True}, "b": {"enabled": False}, "c": {"enabled": True}}
+    records = [{"key": "a", "enabled": True}, {"key": "b", "enabled": True}, {"key": "d", "enabled": False}]
+    assert bot.diff_slot_index(previous, records) == {"new": ["d"], "removed": ["c"], "newly_enabled": ["b"]}
+    assert bot.diff_slot_index(None, records) == {"new": [], "removed": [], "newly_enabled": []}
+
+def test_choose_slot_prefers_fresh_then_earliest():
+    target = bot.Target("http://example/", {})
+    records = [
+        {"key": "2025-10-21T09:00", "date": "2025-10-21", "time": "09:00", "week": 0, "enabled": True},
+        {"key": "2025-10-22T10:00", "date": "2025-10-22", "time": "10:00", "week": 0, "enabled": True},
+        {"key": "2025-10-20T08:00", "date": "2025-10-20", "time": "08:00", "week": 0, "enabled": False},
+    ]
+    diff = {"new": ["2025-10-22T10:00"], "removed": [], "newly_enabled": []}
+    assert bot.choose_slot(records, diff, target)["key"] == "2025-10-22T10:00"
+    assert bot.choose_slot(records, {"new": [], "removed": [], "newly_enabled": []}, target)["key"] == "2025-10-21T09:00"
@@ -0,0 +1,86 @@
+import asyncio
+
+import bot
+
+class FakeButton:
+    def __init__(self, page, step):
+        self.page = page
+        self.step = step
+
+    async def count(self):
+        return 1
+
+    def nth(self, i):
+        return self
+
+    async def is_visible(self):
+        return True
+
+    async def is_enabled(self):
+        return True
+
+    async def get_attribute(self, name):
+        return None
+
+    async def click(self):
+        self.page.week = max(0, self.page.week + self.step)
+
+class FakeWeekPage:
+    """
+    A calendar with one list of slot rows per week. Weeks without slots render
+    nothing, so two of them in a row look exactly the same.
+    """
+
+    def __init__(self, weeks):
+        self.weeks = weeks
+        self.week = 0
+        self.timeouts = []
+
+    def signature(self):
+        return "|".join(row["label"] for row in self.weeks[self.week])
+
+    def get_by_role(self, role, name):
+        return FakeButton(self, 1 if name is bot.NEXT_WEEK_LABEL else -1)
+
+    def locator(self, selector):
+        return (self.week, selector)
+
+    async def evaluate(self, script, arg):
+        if script == bot.WEEK_SIGNATURE_JS:
+            return self.signature()
+        return [dict(row, handle=str(i)) for i, row in enumerate(self.weeks[self.week])]
+
+    async def wait_for_function(self, expression, arg, timeout):
+        self.timeouts.append(timeout)
+        if self.signature() == arg:
+            raise TimeoutError("unchanged")
+
+class FakeTimer:
+    def remaining_ms(self, cap_ms=None):
+        return min(cap_ms or 60000, 60000)
+
+def slot_row(label, enabled=True):
+    return {"label": label, "text": label.split(",")[0], "visible": True,
+            "disabled": None if enabled else "true", "hidden": None}
+
+def test_slot_before_empty_trailing_weeks(monkeypatch):
+    monkeypatch.setattr(bot, "SLOT_INDEX_WEEKS", 4)
+    page = FakeWeekPage([
+        [slot_row("9:00, 20 October", enabled=False)],
+        [slot_row("10:00, 27 October")],
+        [],
+        [],
+    ])
+    timer = FakeTimer()
+
+    async def run():
+        records, page_week = await bot.scan_weeks(page, timer)
+        assert page_week == 3 and page.week == 3
+        choice = [r for r in records if r["enabled"]][0]
+        assert choice["week"] == 1
+        return await bot.locate_indexed_slot(page, choice, page_week, timer)
+
+    assert asyncio.run(run()) == (1, '[data-bot-slot="0"]')
+    assert page.week == 1
+    # An unchanged week costs at most WEEK_CHANGE_TIMEOUT_MS, not the rest of the scan budget
+    assert max(page.timeouts) == bot.WEEK_CHANGE_TIMEOUT_MS